@@ -0,0 +1,82 @@
+"""Benchmark of the storage formats of the SQL cache (:py:meth:`pycof.cache.configure`).
+
+Writes and reloads a data frame mixing integers, floats with NaN, low-cardinality strings and datetimes
+(1M rows x 20 columns by default) with each format, and reports the file size, the write time and the reload time.
+
+Usage:
+    python benchmarks/bench_cache_formats.py --rows 1000000 --cols 20
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from pycof import cache
+from pycof.sqlhelper import _cache_read, _cache_write
+
+CONFIGS = {
+    "parquet (default)": dict(storage="parquet"),
+    "parquet zstd": dict(storage="parquet", compression="zstd", row_group_size=250_000),
+    "parquet zstd-9": dict(storage="parquet", compression="zstd", compression_level=9, row_group_size=250_000),
+    "feather lz4": dict(storage="feather", compression="lz4"),
+    "feather zstd": dict(storage="feather", compression="zstd"),
+    "arrow-ipc": dict(storage="arrow-ipc"),
+}
+
+
+def make_data(rows, cols, seed=0):
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i in range(cols):
+        kind = i % 4
+        if kind == 0:
+            data[f"int_{i}"] = rng.integers(0, 1_000_000, rows)
+        elif kind == 1:
+            values = rng.random(rows)
+            values[rng.random(rows) < 0.1] = np.nan
+            data[f"float_{i}"] = values
+        elif kind == 2:
+            data[f"str_{i}"] = pd.Series(rng.choice(["FR", "US", "UK", "DE", "JP"], rows), dtype=object)
+        else:
+            data[f"date_{i}"] = pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 10**8, rows), unit="s")
+    return pd.DataFrame(data)
+
+
+def run(name, options, data, folder, backend):
+    defaults = {"compression": None, "compression_level": None, "row_group_size": None, "use_dictionary": None}
+    cache._settings.update(defaults, **options)
+    path = os.path.join(folder, name.replace(" ", "_") + cache._STORAGE_EXTENSIONS[options["storage"]])
+
+    start = time.perf_counter()
+    _cache_write(data, path)
+    write_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _cache_read(path, backend=backend)
+    read_time = time.perf_counter() - start
+
+    size = os.path.getsize(path) / 1024**2
+    print(f"{name:<20} {size:>10.1f}MB {write_time:>10.2f}s {read_time:>10.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--cols", type=int, default=20)
+    parser.add_argument("--backend", default="pandas", choices=["pandas", "arrow", "pyarrow"])
+    args = parser.parse_args()
+
+    data = make_data(args.rows, args.cols)
+    print(f"Caching {args.rows:,} rows x {args.cols} columns, reloaded with the {args.backend} backend")
+    print(f"{'format':<20} {'size':>12} {'write':>11} {'reload':>11}")
+    with tempfile.TemporaryDirectory() as folder:
+        for name, options in CONFIGS.items():
+            run(name, options, data, folder, args.backend)
+
+
+if __name__ == "__main__":
+    main()
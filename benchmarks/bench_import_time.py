@@ -0,0 +1,44 @@
+"""Benchmark of the time needed to import PYCOF (``python -X importtime``).
+
+Runs the import in new interpreters and reports the median total time, and the slowest modules imported.
+The statement can be changed to measure the modules loaded when using a function, e.g. ``pycof.group(1234)``.
+
+Usage:
+    python benchmarks/bench_import_time.py --code "import pycof" --repeat 5 --top 15
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+
+def import_times(code):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "cumulative" not in line:
+            _, self_time, cumulative, module = [x.strip() for x in line.replace("import time:", "|").split("|")]
+            times[module] = (int(self_time), int(cumulative))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--code", default="import pycof")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    runs = [import_times(args.code) for _ in range(args.repeat)]
+    totals = [sum(self_time for self_time, _ in run.values()) for run in runs]
+    print(f"{args.code!r}: {statistics.median(totals) / 1000:.1f}ms (median of {args.repeat} runs)")
+    print(f"{'module':<50} {'self':>10} {'cumulative':>12}")
+    for module, (self_time, cumulative) in sorted(runs[-1].items(), key=lambda x: -x[1][1])[: args.top]:
+        print(f"{module:<50} {self_time / 1000:>8.1f}ms {cumulative / 1000:>10.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Benchmark of the data preparation step of :obj:`pycof.sqlhelper._insert_data`.
+
+Compares the row-wise preparation used up to version 1.8.0 with the column-wise one, on a data frame mixing
+integers, floats with NaN, strings with None and datetimes with NaT (1M rows x 50 columns by default).
+
+Usage:
+    python benchmarks/bench_insert_data.py --rows 1000000 --cols 50
+"""
+
+import argparse
+import datetime
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from pycof.sqlhelper import _prepare_rows
+
+
+def make_data(rows, cols, seed=0):
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i in range(cols):
+        kind = i % 5
+        if kind == 0:
+            data[f"int_{i}"] = rng.integers(0, 1_000_000, rows)
+        elif kind in [1, 2]:
+            values = rng.random(rows)
+            values[rng.random(rows) < 0.1] = np.nan
+            data[f"float_{i}"] = values
+        elif kind == 3:
+            values = pd.Series(rng.integers(0, 1000, rows)).astype(str).astype(object)
+            values[rng.random(rows) < 0.1] = None
+            data[f"str_{i}"] = values
+        else:
+            values = pd.Series(pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 10**8, rows), unit="s"))
+            values[rng.random(rows) < 0.1] = pd.NaT
+            data[f"date_{i}"] = values
+    return pd.DataFrame(data)
+
+
+def legacy_prepare_rows(data):
+    """Preparation step of _insert_data up to version 1.8.0 (with autofill_nan=True)."""
+    data = data.copy()  # The legacy version modified the input in place
+    warnings.filterwarnings("ignore")
+    for col in data.columns:
+        if type(data.sample(1).reset_index()[col][0]) in [datetime.date, pd.Timestamp]:
+            try:
+                data[col] = pd.to_datetime(data[col]).apply(str)
+            except ValueError:
+                pass
+    warnings.filterwarnings("default")
+    data_load = []
+    for ls in [v for v in data.fillna("@@@@EMPTYDATA@@@@").values.tolist()]:
+        data_load += [[None if vv == "@@@@EMPTYDATA@@@@" else vv for vv in ls]]
+    return data_load
+
+
+def run(name, func, data):
+    start = time.perf_counter()
+    func(data)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<12} {elapsed:>8.2f}s {len(data) / elapsed:>14,.0f} rows/sec")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--cols", type=int, default=50)
+    parser.add_argument("--skip-legacy", action="store_true", help="Only run the column-wise preparation")
+    args = parser.parse_args()
+
+    data = make_data(args.rows, args.cols)
+    print(f"Preparing {args.rows:,} rows x {args.cols} columns")
+    if not args.skip_legacy:
+        run("legacy", legacy_prepare_rows, data)
+    run("column-wise", lambda df: _prepare_rows(df, autofill_nan=True), data)
+    run("+ tolist", lambda df: _prepare_rows(df, autofill_nan=True).tolist(), data)
+
+
+if __name__ == "__main__":
+    main()
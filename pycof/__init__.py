@@ -1,8 +1,53 @@
+import importlib
+
 from .about import _version as __version__
-from .data import *
-from .format import *
-from .misc import _get_config as get_config
-from .misc import _pycof_folders as pycof_folders
-from .misc import setup_logging
-from .misc import setup_logging as get_logger
-from .sql import *
+
+# Public names and the module and attribute they come from. Modules are only imported when one of their names
+# is first used (PEP 562), so that `import pycof` does not load pandas, boto3 or the SQL drivers.
+_LAZY = {
+    "read": ("data", "read"),
+    "f_read": ("data", "f_read"),
+    "send_email": ("format", "send_email"),
+    "google_email": ("format", "google_email"),
+    "add_zero": ("format", "add_zero"),
+    "group": ("format", "group"),
+    "replace_zero": ("format", "replace_zero"),
+    "week_sunday": ("format", "week_sunday"),
+    "display_name": ("format", "display_name"),
+    "str2bool": ("format", "str2bool"),
+    "GoogleCalendar": ("format", "GoogleCalendar"),
+    "GetEmails": ("format", "GetEmails"),
+    "default_scopes": ("format", "default_scopes"),
+    "write": ("misc", "write"),
+    "file_age": ("misc", "file_age"),
+    "verbose_display": ("misc", "verbose_display"),
+    "EmailSSHTunnel": ("misc", "EmailSSHTunnel"),
+    "get_config": ("misc", "_get_config"),
+    "pycof_folders": ("misc", "_pycof_folders"),
+    "setup_logging": ("misc", "setup_logging"),
+    "get_logger": ("misc", "setup_logging"),
+    "remote_execute_sql": ("sql", "remote_execute_sql"),
+    "execute_many_sql": ("sql", "execute_many_sql"),
+    "close_all": ("sql", "close_all"),
+    "SSHTunnel": ("sqlhelper", "SSHTunnel"),
+    "create_ssh_tunnel": ("sqlhelper", "create_ssh_tunnel"),
+}
+_SUBMODULES = ["about", "aio", "cache", "data", "format", "misc", "sql", "sqlhelper"]
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        module, attr = _LAZY[name]
+        value = getattr(importlib.import_module(f".{module}", __name__), attr)
+        # Cache the attribute, next accesses do not go through __getattr__
+        globals()[name] = value
+        return value
+    if name in _SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY) | set(_SUBMODULES))
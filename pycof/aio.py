@@ -0,0 +1,128 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .data import read as _read
+from .misc import write as _write
+from .sql import remote_execute_sql
+
+#######################################################################################################################
+# Bounded executor running the blocking calls
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def set_max_workers(max_workers):
+    """Set the maximum number of blocking calls (SQL queries, S3 transfers) running at the same time.
+    The default is 16, or the value of the environment variable :obj:`PYCOF_AIO_WORKERS`.
+
+    :Parameters:
+        * **max_workers** (:obj:`int`): Number of threads running the blocking calls.
+
+    :Example:
+        >>> pycof.aio.set_max_workers(32)
+    """
+    global _executor
+    with _executor_lock:
+        previous, _executor = _executor, ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pycof-aio")
+    if previous is not None:
+        previous.shutdown(wait=False)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            max_workers = int(os.environ.get("PYCOF_AIO_WORKERS", 16))
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pycof-aio")
+        return _executor
+
+
+async def _run(func, *args, executor=None, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor or _get_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def _iterate(generator):
+    """Asynchronous iterator over a blocking generator.
+    A dedicated thread advances the generator, database connections being bound to the thread opening them.
+    """
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pycof-aio-stream")
+    done = object()
+    try:
+        while True:
+            batch = await _run(next, generator, done, executor=executor)
+            if batch is done:
+                break
+            yield batch
+    finally:
+        await _run(generator.close, executor=executor)
+        executor.shutdown(wait=False)
+
+
+#######################################################################################################################
+# Asynchronous functions
+
+
+async def execute_sql(sql_query="", *args, **kwargs):
+    """Asynchronous version of :py:meth:`pycof.sql.remote_execute_sql`.
+    Queries run on a bounded pool of threads (see :py:meth:`pycof.aio.set_max_workers`) so that several queries can
+    overlap without blocking the event loop. Connections are pooled by default (:obj:`pool=True`).
+
+    :Parameters:
+        * **sql_query** (:obj:`str`): SQL query to be executed (defaults "").
+        * **\\*args** and **\\*\\*kwargs**: Arguments to be passed to :py:meth:`pycof.sql.remote_execute_sql`.
+
+    :Example:
+        >>> queries = [f"SELECT * FROM SCHEMA.TABLE WHERE country = '{c}'" for c in ["FR", "US"]]
+        >>> dfs = await asyncio.gather(*[pycof.aio.execute_sql(sql) for sql in queries])
+        >>> async for batch in await pycof.aio.execute_sql("SELECT * FROM SCHEMA.TABLE", chunksize=10000):
+        ...     process(batch)
+
+    :Returns:
+        * :obj:`pandas.DataFrame`: Result of the SQL query, or an asynchronous iterator of batches if :obj:`stream=True` or :obj:`chunksize` is provided.
+    """
+    kwargs.setdefault("pool", True)
+    sql_out = await _run(remote_execute_sql, sql_query, *args, **kwargs)
+    if hasattr(sql_out, "__next__"):
+        return _iterate(sql_out)
+    return sql_out
+
+
+async def read(path, *args, **kwargs):
+    """Asynchronous version of :py:meth:`pycof.data.read`.
+    Files are read on a bounded pool of threads, so that several S3 objects can be fetched concurrently.
+
+    :Parameters:
+        * **path** (:obj:`str`): Path of the file to read.
+        * **\\*args** and **\\*\\*kwargs**: Arguments to be passed to :py:meth:`pycof.data.read`.
+
+    :Example:
+        >>> paths = ["s3://bucket/path/to/file1.parquet", "s3://bucket/path/to/file2.parquet"]
+        >>> df1, df2 = await asyncio.gather(*[pycof.aio.read(path) for path in paths])
+
+    :Returns:
+        * :obj:`pandas.DataFrame`: Data frame a string from file read.
+    """
+    return await _run(_read, path, *args, **kwargs)
+
+
+async def write(file, path, *args, **kwargs):
+    """Asynchronous version of :py:meth:`pycof.misc.write`.
+    Files are written on a bounded pool of threads, so that several S3 uploads can run concurrently.
+
+    :Parameters:
+        * **file** (:obj:`str` or :obj:`pandas.DataFrame`): Line of text or object to be inserted in the file.
+        * **path** (:obj:`str`): File on which to write.
+        * **\\*args** and **\\*\\*kwargs**: Arguments to be passed to :py:meth:`pycof.misc.write`.
+
+    :Example:
+        >>> await asyncio.gather(pycof.aio.write(df1, "s3://bucket/df1.parquet"), pycof.aio.write(df2, "s3://bucket/df2.parquet"))
+
+    :Returns:
+        * :obj:`int`: Number of characters inserted if verbose is True.
+    """
+    return await _run(_write, file, path, *args, **kwargs)
@@ -0,0 +1,564 @@
+import atexit
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from .misc import _atomic_path, _file_lock, _pycof_folders
+
+########################################################################################################################
+# Cache settings
+
+_settings = {
+    "max_bytes": int(os.environ["PYCOF_CACHE_MAX_BYTES"]) if os.environ.get("PYCOF_CACHE_MAX_BYTES") else None,
+    "max_entries": int(os.environ["PYCOF_CACHE_MAX_ENTRIES"]) if os.environ.get("PYCOF_CACHE_MAX_ENTRIES") else None,
+    "ttl": os.environ.get("PYCOF_CACHE_TTL"),
+    "memory_bytes": int(os.environ.get("PYCOF_CACHE_MEMORY_BYTES", 512 * 1024**2)),
+    "copy_on_return": os.environ.get("PYCOF_CACHE_COPY", "").lower() in ["1", "true", "yes"],
+    "storage": os.environ.get("PYCOF_CACHE_FORMAT", "parquet"),
+    "compression": os.environ.get("PYCOF_CACHE_COMPRESSION"),
+    "compression_level": None,
+    "row_group_size": None,
+    "use_dictionary": None,
+    "zero_copy": os.environ.get("PYCOF_CACHE_ZERO_COPY", "").lower() in ["1", "true", "yes"],
+}
+
+_STORAGE_EXTENSIONS = {"parquet": ".parquet", "feather": ".feather", "arrow-ipc": ".arrow"}
+
+
+def _storage_options():
+    """Options of the storage format set in :py:meth:`configure`, options left to None use the library defaults."""
+    names = ["compression", "compression_level", "row_group_size"]
+    names += ["use_dictionary"] if _settings["storage"] == "parquet" else []
+    return {name: _settings[name] for name in names if _settings[name] is not None}
+
+
+def _seconds(value):
+    """Convert a duration such as 30, '30mins', '24h' or '7 days' to seconds."""
+    if value is None:
+        return None
+    elif type(value) in [float, int]:
+        return float(value)
+    str_value = str(value).lower().replace(" ", "")
+    number = float("".join(re.findall("[^a-z]", str_value)))
+    unit = "".join(re.findall("[a-z]", str_value))
+    if unit in ["", "s", "sec", "second", "seconds"]:
+        return number
+    elif unit in ["m", "min", "mins", "minute", "minutes"]:
+        return number * 60
+    elif unit in ["h", "hr", "hrs", "hour", "hours"]:
+        return number * 3600
+    elif unit in ["d", "day", "days"]:
+        return number * 24 * 3600
+    elif unit in ["w", "wk", "wks", "week", "weeks"]:
+        return number * 7 * 24 * 3600
+    else:
+        raise ValueError(
+            f"Duration unit is not correct. Can be 'seconds', 'minutes', 'hours', 'days' or 'weeks'. Got '{value}'."
+        )
+
+
+def configure(
+    max_bytes=None,
+    max_entries=None,
+    ttl=None,
+    memory_bytes=None,
+    copy_on_return=None,
+    storage=None,
+    compression=None,
+    compression_level=None,
+    row_group_size=None,
+    use_dictionary=None,
+    zero_copy=None,
+):
+    """Set the limits of the PYCOF cache (SQL queries from :py:meth:`pycof.sql.remote_execute_sql` and files downloaded
+    from S3 by :py:meth:`pycof.data.read`). When a limit is exceeded, the least recently used entries are deleted.
+    Limits can also be set with the environment variables :obj:`PYCOF_CACHE_MAX_BYTES`, :obj:`PYCOF_CACHE_MAX_ENTRIES`,
+    :obj:`PYCOF_CACHE_TTL`, :obj:`PYCOF_CACHE_MEMORY_BYTES`, :obj:`PYCOF_CACHE_COPY`, :obj:`PYCOF_CACHE_FORMAT`,
+    :obj:`PYCOF_CACHE_COMPRESSION` and :obj:`PYCOF_CACHE_ZERO_COPY`.
+    Arguments left to None keep their current value.
+
+    Outputs of cached SQL queries are also kept in memory, so that repeated calls in the same process return them
+    without reading the disk. Set :obj:`copy_on_return=True` if the returned data frames are modified in place.
+
+    Cached data are stored as parquet files by default. Feather and Arrow IPC files are larger but faster to reload,
+    Arrow IPC files are uncompressed unless a compression is set and are memory-mapped when read.
+    Changing the storage format creates new cache entries. With :obj:`zero_copy=True`, cached Arrow IPC files are
+    returned as data frames with Arrow-backed columns wrapping the memory-mapped file: nothing is copied when reading
+    the cache, processes reading the same entry share its pages and columns are only loaded from disk when used.
+
+    :Parameters:
+        * **max_bytes** (:obj:`int`): Maximum size of the cached data on disk, in bytes (defaults None, no limit).
+        * **max_entries** (:obj:`int`): Maximum number of cached entries on disk (defaults None, no limit).
+        * **ttl** (:obj:`str`): Age after which entries are deleted, e.g. '7days' (defaults None, no limit).
+        * **memory_bytes** (:obj:`int`): Maximum size of the in-memory cache, in bytes. Set to 0 to disable it (defaults 512MB).
+        * **copy_on_return** (:obj:`bool`): Return copies of the data frames kept in memory (defaults False).
+        * **storage** (:obj:`str`): Storage format of the cached data, either 'parquet', 'feather' or 'arrow-ipc' (defaults 'parquet').
+        * **compression** (:obj:`str`): Compression codec, e.g. 'zstd', 'lz4' or 'snappy' (parquet only) (defaults None, default of the format).
+        * **compression_level** (:obj:`int`): Compression level of the codec (defaults None).
+        * **row_group_size** (:obj:`int`): Maximum number of rows per parquet row group or per Feather/Arrow IPC record batch (defaults None).
+        * **use_dictionary** (:obj:`bool`): Dictionary encoding of parquet columns (defaults None, enabled).
+        * **zero_copy** (:obj:`bool`): Return data frames with Arrow-backed columns from memory-mapped Arrow IPC files, as with :obj:`backend="arrow"` (defaults False).
+
+    :Example:
+        >>> pycof.cache.configure(max_bytes=10 * 1024**3, ttl="30days", memory_bytes=2 * 1024**3)
+        >>> pycof.cache.configure(storage="parquet", compression="zstd", row_group_size=100000)
+        >>> pycof.cache.configure(storage="arrow-ipc", zero_copy=True)
+
+    :Returns:
+        * :obj:`dict`: The cache limits.
+    """
+    for name, value in [
+        ("max_bytes", max_bytes),
+        ("max_entries", max_entries),
+        ("ttl", ttl),
+        ("memory_bytes", memory_bytes),
+        ("copy_on_return", copy_on_return),
+        ("storage", storage),
+        ("compression", compression),
+        ("compression_level", compression_level),
+        ("row_group_size", row_group_size),
+        ("use_dictionary", use_dictionary),
+        ("zero_copy", zero_copy),
+    ]:
+        if value is not None:
+            _settings[name] = value
+    if _settings["storage"] not in _STORAGE_EXTENSIONS:
+        raise ValueError(f"Storage should be one of {', '.join(_STORAGE_EXTENSIONS)}, got '{_settings['storage']}'")
+    _seconds(_settings["ttl"])  # Fail early on incorrect durations
+    with _memory_lock:
+        _memory_evict()
+    return dict(_settings)
+
+
+########################################################################################################################
+# In-memory cache
+
+_memory = OrderedDict()
+_memory_lock = threading.Lock()
+_memory_stats = {"hits": 0, "bytes": 0}
+
+
+# Number of values of object columns measured to estimate the size of a data frame
+_SIZE_SAMPLE = 1000
+
+
+def _nbytes(sql_out):
+    """Estimated size of an output. Measuring every Python object of a data frame (:obj:`deep=True`) is slow on large
+    frames, the size of object columns is extrapolated from a sample of their values instead. Arrow data is not copied
+    to be measured.
+    """
+    if isinstance(sql_out, pd.DataFrame):
+        size = int(sql_out.memory_usage(index=True, deep=False).sum())
+        for i in range(sql_out.shape[1]):
+            values = sql_out.iloc[:, i]
+            if (values.dtype == object) and (len(values) > 0):
+                sample = values.iloc[:: max(1, len(values) // _SIZE_SAMPLE)]
+                size += int(sample.map(sys.getsizeof).mean() * len(values))
+        return size
+    return int(getattr(sql_out, "nbytes", 0))
+
+
+def _memory_get(path, backend="pandas", ttl=None):
+    """Return the output kept in memory and its creation timestamp, or None if missing or older than the TTL."""
+    key = (os.path.abspath(path), backend)
+    with _memory_lock:
+        if key not in _memory:
+            return None
+        sql_out, created, size = _memory[key]
+        if (ttl is not None) and (time.time() - created >= ttl):
+            del _memory[key]
+            _memory_stats["bytes"] -= size
+            return None
+        _memory.move_to_end(key)
+        _memory_stats["hits"] += 1
+    # The entry is still used, its last access on disk is updated for the LRU eviction (not counted as a disk hit)
+    _touch(path, hits=0)
+    if _settings["copy_on_return"] and isinstance(sql_out, pd.DataFrame):
+        sql_out = sql_out.copy()
+    return sql_out, created
+
+
+def _memory_put(path, sql_out, created, backend="pandas"):
+    """Keep an output in memory, least recently used outputs are dropped to stay below the memory limit."""
+    if int(_settings["memory_bytes"]) <= 0:
+        return
+    size = _nbytes(sql_out)
+    if size > int(_settings["memory_bytes"]):
+        return
+    if _settings["copy_on_return"] and isinstance(sql_out, pd.DataFrame):
+        # Modifications of the returned data frame must not reach the cached one
+        sql_out = sql_out.copy()
+    key = (os.path.abspath(path), backend)
+    with _memory_lock:
+        if key in _memory:
+            _memory_stats["bytes"] -= _memory.pop(key)[2]
+        _memory[key] = (sql_out, created, size)
+        _memory_stats["bytes"] += size
+        _memory_evict()
+
+
+def _memory_evict():
+    while _memory and (_memory_stats["bytes"] > int(_settings["memory_bytes"])):
+        _memory_stats["bytes"] -= _memory.popitem(last=False)[1][2]
+
+
+def _memory_forget(path=None):
+    """Drop the outputs of a cached entry (all backends), or all outputs if no path is provided."""
+    with _memory_lock:
+        for key in [k for k in _memory if (path is None) or (k[0] == os.path.abspath(path))]:
+            _memory_stats["bytes"] -= _memory.pop(key)[2]
+
+
+########################################################################################################################
+# Query fingerprints
+
+_SQL_TOKENS = re.compile(
+    r"""(?P<literal>'(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`)"""
+    r"|(?P<comment>--[^\n]*|/\*.*?\*/)"
+    r"|(?P<space>\s+)"
+    r"|(?P<word>\w+)"
+    r"|(?P<other>.)",
+    re.DOTALL,
+)
+
+_SQL_KEYWORDS = {
+    "all", "alter", "and", "any", "as", "asc", "avg", "between", "by", "case", "cast", "coalesce", "count", "create",
+    "cross", "date", "delete", "desc", "distinct", "drop", "else", "end", "except", "exists", "false", "first", "from",
+    "full", "group", "having", "ilike", "in", "inner", "insert", "intersect", "interval", "into", "is", "join", "last",
+    "left", "like", "limit", "max", "min", "not", "null", "nulls", "offset", "on", "or", "order", "outer", "over",
+    "partition", "right", "select", "set", "sum", "table", "then", "true", "union", "update", "using", "values", "when",
+    "where", "with",
+}  # fmt: skip
+
+
+def normalize(sql):
+    """Normalize an SQL query so that queries only differing by comments, whitespaces or keyword case are identical.
+    String literals and quoted identifiers are kept unchanged.
+
+    :Parameters:
+        * **sql** (:obj:`str`): SQL query to normalize.
+
+    :Example:
+        >>> pycof.cache.normalize("select *  -- all columns\n  from SCHEMA.TABLE where id = 'a'")
+        ... "SELECT * FROM SCHEMA.TABLE WHERE id = 'a'"
+
+    :Returns:
+        * :obj:`str`: Normalized SQL query.
+    """
+    tokens = []
+    for match in _SQL_TOKENS.finditer(sql):
+        kind, token = match.lastgroup, match.group()
+        if kind in ["comment", "space"]:
+            if tokens and (tokens[-1] not in [" ", "("]):
+                tokens.append(" ")
+        elif kind == "word":
+            tokens.append(token.upper() if token.lower() in _SQL_KEYWORDS else token)
+        elif (kind == "other") and (token in ",();"):
+            # No space around separators and parentheses
+            if tokens and (tokens[-1] == " "):
+                tokens.pop()
+            tokens += [token, " "] if token == "," else [token]
+        else:
+            tokens.append(token)
+    return "".join(tokens).strip().rstrip(";").strip()
+
+
+def fingerprint(sql, params=None):
+    """Key of an SQL query in the cache, computed from the normalized query (see :py:meth:`pycof.cache.normalize`)
+    and its bind parameters. Queries only differing by comments, whitespaces or keyword case share the same key.
+
+    :Parameters:
+        * **sql** (:obj:`str`): SQL query.
+        * **params** (:obj:`list` or :obj:`dict`): Bind parameters of the query (defaults None).
+
+    :Example:
+        >>> pycof.cache.fingerprint("SELECT * FROM SCHEMA.TABLE") == pycof.cache.fingerprint("select *\nfrom SCHEMA.TABLE;")
+        ... True
+
+    :Returns:
+        * :obj:`str`: Key of the query.
+    """
+    key = normalize(sql)
+    if params is not None:
+        key += "\n" + json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha224(bytes(key, "utf-8")).hexdigest()
+
+
+########################################################################################################################
+# Index of cached entries
+
+
+def _index_path():
+    return os.path.join(_pycof_folders("temp"), "pycof", "cache", "index.json")
+
+
+def _load_index():
+    try:
+        with open(_index_path()) as index_file:
+            return json.load(index_file)
+    except (FileNotFoundError, ValueError):
+        return {"entries": {}, "hits": 0, "misses": 0}
+
+
+def _save_index(index):
+    with _atomic_path(_index_path()) as tmp_path:
+        with open(tmp_path, "w") as index_file:
+            json.dump(index, index_file)
+
+
+def _size(path):
+    """Size of a file, or of all files in a folder."""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _remove_entry(entry):
+    _memory_forget(entry["path"])
+    _remove(entry["path"])
+    if entry.get("query_path"):
+        _remove(entry["query_path"])
+
+
+# Hits are counted in memory and written to the index at most every few seconds, so that reading a cached entry does
+# not rewrite the whole index. Pending hits are also written before the index is read or updated.
+_FLUSH_SECONDS = 5
+# index path -> {entry path -> (hits, last access)}
+_pending = {}
+_pending_lock = threading.Lock()
+_pending_flushed = [time.time()]
+
+
+def _touch(path, hits=1):
+    """Record an access to a cached entry, written to the index with the next flush."""
+    path = os.path.abspath(path)
+    with _pending_lock:
+        pending = _pending.setdefault(_index_path(), {})
+        count, _ = pending.get(path, (0, None))
+        pending[path] = (count + hits, time.time())
+        due = time.time() - _pending_flushed[0] > _FLUSH_SECONDS
+    if due:
+        _flush()
+
+
+def _apply_pending(index):
+    """Move the pending accesses to the index, the caller holds the index lock."""
+    with _pending_lock:
+        pending = _pending.pop(_index_path(), {})
+        _pending_flushed[0] = time.time()
+    for path, (hits, last_access) in pending.items():
+        entry = index["entries"].get(path)
+        if entry is None:
+            if hits == 0:
+                continue
+            # Entry cached before the index existed
+            entry = index["entries"][path] = {
+                "key": os.path.basename(path),
+                "path": path,
+                "created": last_access,
+                "hits": 0,
+                "misses": 0,
+                "size": _size(path),
+            }
+        entry["last_access"] = max(entry.get("last_access", 0), last_access)
+        entry["hits"] += hits
+        index["hits"] += hits
+    return bool(pending)
+
+
+def _flush():
+    """Write the pending accesses to the index."""
+    with _pending_lock:
+        if not _pending.get(_index_path()):
+            _pending_flushed[0] = time.time()
+            return
+    with _file_lock(_index_path() + ".lock"):
+        index = _load_index()
+        if _apply_pending(index):
+            _save_index(index)
+
+
+atexit.register(_flush)
+
+
+def _record(path, hit, query_path=None, query=None):
+    """Record an access to a cached entry. Misses (entry written) update its size and enforce the cache limits."""
+    if hit:
+        _touch(path)
+        return
+    now = time.time()
+    path = os.path.abspath(path)
+    with _file_lock(_index_path() + ".lock"):
+        index = _load_index()
+        _apply_pending(index)
+        entry = index["entries"].setdefault(
+            path, {"key": os.path.basename(path), "path": path, "created": now, "hits": 0, "misses": 0}
+        )
+        entry["last_access"] = now
+        entry["misses"] += 1
+        index["misses"] += 1
+        entry["created"] = now
+        entry["size"] = _size(path)
+        entry["query_path"] = query_path
+        if query is not None:
+            entry["query_key"] = fingerprint(query)
+        _evict(index, keep=path)
+        _save_index(index)
+
+
+def _evict(index, keep=None):
+    """Delete the entries older than the TTL, then the least recently used ones until the limits are met.
+    Sizes are taken from the index, only the entries evicted are touched on disk.
+    """
+    entries = index["entries"]
+    ttl = _seconds(_settings["ttl"])
+    now = time.time()
+    if ttl is not None:
+        for path in [path for path, entry in entries.items() if (now - entry["created"] > ttl) and (path != keep)]:
+            _remove_entry(entries.pop(path))
+
+    max_bytes, max_entries = _settings["max_bytes"], _settings["max_entries"]
+    if (max_bytes is None) and (max_entries is None):
+        return
+    lru = sorted([entry for path, entry in entries.items() if path != keep], key=lambda e: e["last_access"])
+    total = sum(entry.get("size", 0) for entry in entries.values())
+    while lru and (
+        ((max_bytes is not None) and (total > int(max_bytes)))
+        or ((max_entries is not None) and (len(entries) > int(max_entries)))
+    ):
+        entry = lru.pop(0)
+        total -= entry.get("size", 0)
+        _remove_entry(entries.pop(entry["path"]))
+
+
+########################################################################################################################
+# Cache management
+
+
+def evict():
+    """Delete the cached entries exceeding the limits set with :py:meth:`pycof.cache.configure`.
+    Eviction also runs automatically each time an entry is written.
+
+    :Example:
+        >>> pycof.cache.evict()
+    """
+    with _file_lock(_index_path() + ".lock"):
+        index = _load_index()
+        _apply_pending(index)
+        _evict(index)
+        _save_index(index)
+
+
+def stats():
+    """Statistics of the PYCOF cache. Hits served from memory are counted separately from disk hits.
+
+    :Example:
+        >>> pycof.cache.stats()
+        ... {'entries': 12, 'bytes': 104857600, 'hits': 40, 'misses': 12, 'hit_rate': 0.769, ...}
+
+    :Returns:
+        * :obj:`dict`: Number of entries, size in bytes, hits, misses, hit rate, in-memory usage and cache limits.
+    """
+    _flush()
+    index = _load_index()
+    entries = index["entries"].values()
+    requests = index["hits"] + index["misses"]
+    return {
+        "entries": len(entries),
+        "bytes": sum(entry.get("size", 0) for entry in entries),
+        "hits": index["hits"],
+        "misses": index["misses"],
+        "hit_rate": index["hits"] / requests if requests > 0 else None,
+        "memory_entries": len(_memory),
+        "memory_used": _memory_stats["bytes"],
+        "memory_hits": _memory_stats["hits"],
+        **_settings,
+    }
+
+
+def invalidate(query=None, key=None):
+    """Delete cached entries, either from the SQL query or from the cache key (file name or path of the cached data).
+
+    :Parameters:
+        * **query** (:obj:`str`): SQL query whose cached output should be deleted (defaults None).
+        * **key** (:obj:`str`): Name (e.g. :obj:`cache_name`) or path of the cached entry to delete (defaults None).
+
+    :Example:
+        >>> pycof.cache.invalidate(query="SELECT * FROM SCHEMA.TABLE")
+        >>> pycof.cache.invalidate(key=df.meta.cache.cache_path)
+
+    :Returns:
+        * :obj:`int`: Number of entries deleted.
+    """
+    if (query is None) & (key is None):
+        raise ValueError("Provide either the query or the key of the entry to invalidate")
+    query_key = None if query is None else fingerprint(query)
+    with _file_lock(_index_path() + ".lock"):
+        index = _load_index()
+        _apply_pending(index)
+        removed = 0
+        for path, entry in list(index["entries"].items()):
+            name, ext = os.path.splitext(entry["key"])
+            name = name if ext in _STORAGE_EXTENSIONS.values() else entry["key"]
+            if ((query_key is not None) and ((entry.get("query_key") == query_key) or (name == query_key))) or (
+                (key is not None) and ((path == os.path.abspath(key)) or (key in [entry["key"], name]))
+            ):
+                _remove_entry(index["entries"].pop(path))
+                removed += 1
+        _save_index(index)
+    return removed
+
+
+def clear():
+    """Delete all cached data: entries of the index (including custom cache folders) and PYCOF cache folders.
+
+    :Example:
+        >>> pycof.cache.clear()
+    """
+    _memory_forget()
+    with _pending_lock:
+        _pending.pop(_index_path(), None)
+    with _file_lock(_index_path() + ".lock"):
+        index = _load_index()
+        for entry in index["entries"].values():
+            _remove_entry(entry)
+        for folder in ["data", "queries", "s3"]:
+            folder_path = _pycof_folders(folder)
+            for name in os.listdir(folder_path):
+                _remove(os.path.join(folder_path, name))
+        _save_index({"entries": {}, "hits": 0, "misses": 0})
+
+
+def list_entries():
+    """List the cached entries, most recently used first.
+
+    :Example:
+        >>> pycof.cache.list_entries()
+
+    :Returns:
+        * :obj:`pandas.DataFrame`: Key, path, size in bytes, creation and last access dates, hits and misses of each entry.
+    """
+    _flush()
+    index = _load_index()
+    cached = pd.DataFrame(
+        list(index["entries"].values()),
+        columns=["key", "path", "size", "created", "last_access", "hits", "misses", "query_path"],
+    )
+    for col in ["created", "last_access"]:
+        cached[col] = pd.to_datetime(cached[col], unit="s")
+    return cached.sort_values("last_access", ascending=False).reset_index(drop=True)
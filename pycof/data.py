@@ -4,21 +4,32 @@ import hashlib
 import json
 import math
 import os
+import random
 import re
 import sys
+import time
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from io import BytesIO, StringIO
 from types import SimpleNamespace
 from warnings import warn
 
-import boto3
 import numpy as np
 import pandas as pd
-import xlrd
-from botocore.exceptions import ProfileNotFound
 from tqdm import tqdm
 
-from .misc import _get_config, _pycof_folders, file_age, verbose_display, write
+from .cache import _record
+from .misc import (
+    _DATA_FORMATS,
+    _aws_client,
+    _aws_session,
+    _pycof_folders,
+    _s3_credentials,
+    _s3_filesystem,
+    file_age,
+    verbose_display,
+    write,
+)
 
 ##############################################################################################################################
 
@@ -37,6 +48,10 @@ def read(
     cache="30mins",
     cache_name=None,
     verbose=False,
+    columns=None,
+    filters=None,
+    chunksize=None,
+    max_workers=8,
     **kwargs,
 ):
     """Read and parse a data file.
@@ -46,7 +61,7 @@ def read(
 
     :Parameters:
         * **path** (:obj:`str`): path to the SQL file.
-        * **extension** (:obj:`str`): extension to use. Can be 'csv', 'txt', 'xslsx', 'sql', 'html', 'py', 'json', 'js', 'parquet', 'read-only' (defaults None).
+        * **extension** (:obj:`str`): extension to use. Can be 'csv', 'txt', 'xslsx', 'sql', 'html', 'py', 'json', 'ndjson', 'js', 'parquet', 'feather', 'arrow', 'read-only' (defaults None).
         * **parse** (:obj:`bool`): Format the query to remove trailing space and comments, ready to use format (defaults True).
         * **remove_comments** (:obj:`bool`): Remove comments from the loaded file (defaults True).
         * **sep** (:obj:`str`): Columns delimiter for pd.read_csv (defaults ',').
@@ -57,6 +72,10 @@ def read(
         * **cache** (:obj:`str`): Caches the data to avoid downloading again.
         * **cache_name** (:obj:`str`): File name for storing cache data, if None the name will be generated by hashing the path (defaults None).
         * **verbose** (:obj:`bool`): Display intermediate steps (defaults False).
+        * **columns** (:obj:`list`): Columns to load from parquet, feather and Arrow IPC files, other columns are not read (defaults None, all columns).
+        * **filters** (:obj:`list`): Row filters for parquet files, as a :obj:`pyarrow.compute.Expression` or a list of tuples such as :obj:`[("country", "=", "FR"), ("year", ">=", 2020)]`. Row groups and partitions not matching the filters are skipped (defaults None).
+        * **max_workers** (:obj:`int`): Number of objects downloaded concurrently when an S3 folder is downloaded to the cache (defaults 8).
+        * **chunksize** (:obj:`int`): Number of rows per batch for CSV and JSON lines files (.ndjson, or .json with :obj:`lines=True`). If provided, an iterator of data frames is returned, and files on S3 are downloaded as the batches are read (defaults None).
         * **\\*\\*kwargs** (:obj:`str`): Arguments to be passed to the engine or values to be formated in the file to load.
 
     :Configuration:
@@ -77,11 +96,16 @@ def read(
         >>> df1 = pycof.read('/path/to/df_file.json')
         >>> df2 = pycof.read('/path/to/df.csv')
         >>> df3 = pycof.read('s3://bucket/path/to/file.parquet')
+        >>> df4 = pycof.read('s3://bucket/path/to/dataset.parquet', columns=['id', 'amount'], filters=[('country', '=', 'FR')])
+        >>> for batch in pycof.read('s3://bucket/path/to/large_file.csv', chunksize=100000):
+        ...     process(batch)
     :Returns:
         * :obj:`pandas.DataFrame`: Data frame a string from file read.
+        * :obj:`iterator`: Batches of :obj:`pandas.DataFrame` if :obj:`chunksize` is provided.
     """
     # Initialize ext var
     ext = path.split(".")[-1] if extension is None else extension
+    fmt = _DATA_FORMATS.get(ext.lower())
     # Initialize orgn var
     if path.startswith("s3://"):
         orgn = "S3"
@@ -91,50 +115,33 @@ def read(
         orgn = "other"
     # Initialize data var
     data = []
+    # S3 file system, only set when the data is read from S3 directly rather than from the local cache
+    filesystem = None
 
     if orgn == "S3":
-        try:
-            sess = boto3.session.Session(profile_name=profile_name)
-            s3 = sess.client("s3")
-            s3_resource = sess.resource("s3")
-        except ProfileNotFound:
-            config = _get_config(credentials)
-            s3 = boto3.client(
-                "s3",
-                aws_access_key_id=config.get("AWS_ACCESS_KEY_ID"),
-                aws_secret_access_key=config.get("AWS_SECRET_ACCESS_KEY"),
-                region_name=config.get("REGION"),
-            )
-            s3_resource = boto3.resource(
-                "s3",
-                aws_access_key_id=config.get("AWS_ACCESS_KEY_ID"),
-                aws_secret_access_key=config.get("AWS_SECRET_ACCESS_KEY"),
-                region_name=config.get("REGION"),
-            )
-        except FileNotFoundError:
-            raise ConnectionError(
-                "Please run 'aws config' on your terminal and initialize the parameters or profide a correct value for crendetials."
-            )
+        aws = _s3_credentials(profile_name, credentials)
+        # Enough connections for all the requests of the objects downloaded in parallel
+        s3 = _aws_client("s3", max_pool_connections=max(10, max_workers * _DOWNLOAD_CONCURRENCY), **aws)
 
         bucket = path.replace("s3://", "").split("/")[0]
         folder_path = "/".join(path.replace("s3://", "").split("/")[1:])
 
-        if ext.lower() in [
-            "csv",
-            "txt",
-            "parq",
-            "parquet",
-            "fea",
-            "feather",
-            "html",
-            "json",
-            "js",
-            "py",
-            "sh",
-            "xls",
-            "xlsx",
-        ]:
-            # If file can be loaded by pandas, we do not download locally
+        if fmt == "parquet":
+            # Parquet files and datasets are scanned on S3, only the columns and row groups needed are downloaded
+            verbose_display("Scanning the data from S3 directly", verbose)
+            filesystem = _s3_filesystem(_aws_session(**aws), bucket)
+            path = f"{bucket}/{folder_path}"
+        elif fmt is not None:
+            # Data files are parsed while being downloaded instead of being loaded in memory first.
+            # CSV and JSON files are read sequentially, feather, Arrow IPC and Excel files with range requests.
+            verbose_display("Streaming the data from S3", verbose)
+            filesystem = _s3_filesystem(_aws_session(**aws), bucket)
+            if fmt in ["csv", "json", "ndjson"]:
+                path = filesystem.open_input_stream(f"{bucket}/{folder_path}", compression=None)
+            else:
+                path = filesystem.open_input_file(f"{bucket}/{folder_path}")
+        elif ext.lower() in ["html", "js", "py", "sh"]:
+            # Text files are loaded in memory, we do not download locally
             verbose_display("Loading the data from S3 directly", verbose)
             obj = s3.get_object(Bucket=bucket, Key=folder_path)
             path = BytesIO(obj["Body"].read())
@@ -144,7 +151,6 @@ def read(
             # and cannot be loaded by pandas.
 
             cache_time = 0.0 if cache is False else cache
-            _disp = tqdm if verbose else list
             # Force the input to be a string
             str_c_time = str(cache_time).lower().replace(" ", "")
             # Get the numerical part of the input
@@ -159,9 +165,6 @@ def read(
             # Changing path to local once file is downloaded to tmp folder
             path = os.path.join(data_path, file_name)
 
-            # Set the S3 bucket
-            s3bucket = s3_resource.Bucket(bucket)
-
             # First, check if the same path has already been downloaded locally
             if file_name in os.listdir(data_path):
                 # If yes, check when and compare to cache time
@@ -169,6 +172,7 @@ def read(
                     # If cache is recent, no need to download
                     ext = os.listdir(path)[0].split(".")[-1]
                     verbose_display("Data file available in cache", verbose)
+                    _record(path, hit=True)
                 else:
                     # Otherwise, we update the cache
                     verbose_display("Updating data in cache", verbose)
@@ -177,32 +181,26 @@ def read(
                         for name in files:
                             os.remove(os.path.join(root, name))
                     # Downloading the objects from S3
-                    for obj in _disp(s3bucket.objects.filter(Prefix=folder_path)):
-                        if (obj.key == folder_path) or (
-                            not any(
-                                e in obj.key for e in [".parquet", ".parq", ".feather", ".fea", ".csv", ".json", ".txt"]
-                            )
-                        ):
-                            continue
-                        else:
-                            s3bucket.download_file(obj.key, os.path.join(path, obj.key.split("/")[-1]))
-                            ext = obj.key.split(".")[-1]
+                    extensions = ["." + e for e, f in _DATA_FORMATS.items() if f != "excel"]
+                    ext = _download_prefix(
+                        s3, bucket, folder_path, path, extensions=extensions, max_workers=max_workers, verbose=verbose
+                    )
+                    _record(path, hit=False)
             else:
                 # If the file is not in the cache, we download it
                 verbose_display("Downloading and caching data", verbose)
                 # Creating the directory
                 os.makedirs(path, exist_ok=True)
-                for obj in _disp(s3bucket.objects.filter(Prefix=folder_path)):
-                    if obj.key == folder_path:
-                        continue
-                    s3bucket.download_file(obj.key, os.path.join(path, obj.key.split("/")[-1]))
-                    ext = obj.key.split(".")[-1]
+                ext = _download_prefix(s3, bucket, folder_path, path, max_workers=max_workers, verbose=verbose)
+                _record(path, hit=False)
+            # The format is the one of the files downloaded
+            fmt = _DATA_FORMATS.get(ext.lower())
 
     # CSV / txt
-    if ext.lower() in ["csv", "txt"]:
-        data = pd.read_csv(path, sep=sep, **kwargs)
+    if fmt == "csv":
+        data = pd.read_csv(path, sep=sep, chunksize=chunksize, **kwargs)
     # XLSX
-    elif ext.lower() in ["xls", "xlsx"]:
+    elif fmt == "excel":
         _engine = "openpyxl" if engine == "auto" else engine
         data = pd.read_excel(path, sheet_name=sheet_name, engine=_engine, **kwargs)
     # SQL
@@ -278,12 +276,17 @@ def read(
                 data += [l_striped]
         data = " ".join(data)
     # Json
-    elif ext.lower() in ["json"]:
-        if engine.lower() in ["json"]:
+    elif fmt == "json":
+        if engine.lower() in ["json"] and isinstance(path, str):
             with open(path) as json_file:
                 data = json.load(json_file)
+        elif engine.lower() in ["json"]:
+            data = json.load(path)
         else:
-            data = pd.read_json(path, **kwargs)
+            data = pd.read_json(path, chunksize=chunksize, **kwargs)
+    # Newline-delimited json
+    elif fmt == "ndjson":
+        data = pd.read_json(path, lines=True, chunksize=chunksize, **kwargs)
     elif ext.lower() in ["jsonc"]:
         if isinstance(path, BytesIO):
             file = path.read().decode()
@@ -303,33 +306,46 @@ def read(
         str_content = str_content.replace(", }", "}")
         data = json.loads(str_content)
     # Parquet
-    elif ext.lower() in ["parq", "parquet"]:
+    elif fmt == "parquet":
         _engine = "pyarrow" if engine == "auto" else engine
 
-        if orgn == "S3":
-            data = pd.read_parquet(path)
+        if filesystem is not None:
+            import pyarrow.parquet as pq
+
+            dataset = pq.ParquetDataset(path, filesystem=filesystem, filters=filters)
+            data = dataset.read(columns=columns, use_pandas_metadata=True).to_pandas()
         elif isinstance(_engine, str):
             if _engine.lower() in ["py", "pa", "pyarrow"]:
                 import pyarrow.parquet as pq
 
-                dataset = pq.ParquetDataset(path, **kwargs)
-                table = dataset.read()
+                # Only the columns and the row groups matching the filters are read and decoded
+                dataset = pq.ParquetDataset(path, filters=filters, **kwargs)
+                table = dataset.read(columns=columns)
                 data = table.to_pandas()
             elif _engine.lower() in ["fp", "fastparquet"]:
                 from fastparquet import ParquetFile
 
                 dataset = ParquetFile(path, **kwargs)
-                table = dataset.to_pandas()
+                data = dataset.to_pandas(columns=columns, filters=filters or [])
             else:
                 raise ValueError("Engine value not allowed")
         else:
-            data = _engine(path, **kwargs)
+            pushdown = {k: v for k, v in [("columns", columns), ("filters", filters)] if v is not None}
+            data = _engine(path, **pushdown, **kwargs)
     # Feather
-    elif ext.lower() in ["fea", "feather"]:
+    elif fmt == "feather":
         from pyarrow.feather import read_table
 
-        table = read_table(path, **kwargs)
+        table = read_table(path, columns=columns, **kwargs)
         data = table.to_pandas()
+    # Arrow IPC
+    elif fmt == "arrow-ipc":
+        import pyarrow as pa
+
+        # Local files are memory-mapped, only the columns selected are read
+        reader = pa.ipc.open_file(pa.memory_map(path) if isinstance(path, str) else path, **kwargs)
+        table = reader.read_all()
+        data = (table if columns is None else table.select(columns)).to_pandas()
     # Else, read-only
     elif ext.lower() in ["readonly", "read-only", "ro"]:
         if isinstance(path, BytesIO):
@@ -346,6 +362,55 @@ def read(
     return data
 
 
+# Range requests sent in parallel for each large object downloaded
+_DOWNLOAD_CONCURRENCY = 4
+
+
+def _download_prefix(s3, bucket, prefix, folder, extensions=None, max_workers=8, verbose=False, retries=5):
+    """Download the objects of an S3 prefix to a local folder, concurrently.
+    Large objects are downloaded in parts with range requests, failed downloads are retried with exponential backoff.
+    The client needs :obj:`max_workers * _DOWNLOAD_CONCURRENCY` connections in its pool to not drop connections.
+    Returns the extension of the last object downloaded.
+    """
+    from boto3.s3.transfer import TransferConfig
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    keys = []
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if (obj["Key"] == prefix) or ((extensions is not None) and not any(e in obj["Key"] for e in extensions)):
+                continue
+            keys.append(obj["Key"])
+    if len(keys) == 0:
+        raise FileNotFoundError(f"No file found in s3://{bucket}/{prefix}")
+
+    config = TransferConfig(
+        multipart_threshold=64 * 1024**2, multipart_chunksize=16 * 1024**2, max_concurrency=_DOWNLOAD_CONCURRENCY
+    )
+
+    def download(key):
+        for attempt in range(retries):
+            try:
+                return s3.download_file(bucket, key, os.path.join(folder, key.split("/")[-1]), Config=config)
+            except (BotoCoreError, ClientError) as err:
+                code = err.response.get("Error", {}).get("Code") if isinstance(err, ClientError) else None
+                if (code in ["403", "404", "AccessDenied", "NoSuchKey"]) or (attempt == retries - 1):
+                    raise
+                time.sleep(min(0.5 * 2**attempt, 10) * (1 + random.random()))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(download, key) for key in keys]
+        try:
+            for future in tqdm(as_completed(futures), total=len(futures), disable=not verbose):
+                future.result()
+        except BaseException:
+            # Do not start the remaining downloads
+            for future in futures:
+                future.cancel()
+            raise
+    return keys[-1].split(".")[-1]
+
+
 def f_read(*args, **kwargs):
     """Old function to load data file. This function is on deprecation path. Consider using :py:meth:`pycof.data.read` instead.
 
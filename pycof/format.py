@@ -18,21 +18,7 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formataddr
 
-import dateparser
-import numpy as np
-import pandas as pd
-import pytz
-from bs4 import BeautifulSoup
-from dateparser import parse
-from dateutil import tz
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from tqdm import tqdm
-
-from .misc import EmailSSHTunnel, _pycof_folders, file_age, verbose_display
-from .sqlhelper import _get_config, _get_credentials
+from .misc import EmailSSHTunnel, _get_config, _pycof_folders, file_age, verbose_display
 
 # Define default Google API scopes
 default_scopes = ["https://mail.google.com/", "https://www.googleapis.com/auth/calendar.readonly"]
@@ -152,6 +138,9 @@ class google_email:
         :return: Google calendar credentials.
         :rtype: :obj:`google_auth_oauthlib`
         """
+        from google.auth.transport.requests import Request
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
         creds = None
         # The file token.pickle stores the user's access and refresh tokens, and is
         # created automatically when the authorization flow completes for the first
@@ -190,6 +179,9 @@ class google_email:
         :return: If `return_status=True`, returns a dictionnary with the status of the email.
         :rtype: :obj:`dict`
         """
+        from googleapiclient.discovery import build
+        from googleapiclient.errors import HttpError
+
         config = _get_config(self._creds)
         try:
             service = build("gmail", "v1", credentials=self._get_creds())
@@ -231,6 +223,12 @@ class google_email:
         :return: Data frame with last emails.
         :rtype: :obj:`pandas.DataFrame`
         """
+        import dateparser
+        import numpy as np
+        import pandas as pd
+        from dateutil import tz
+        from googleapiclient.discovery import build
+
         creds = self._get_creds()
 
         # Connect to the Gmail API
@@ -542,6 +540,8 @@ class GoogleCalendar:
             This file can be generated at https://developers.google.com/calendar/quickstart/python.
             User will need to enable the Google Calendar API on the account from Step 1.
         """
+        import pytz
+
         self.timezone = pytz.timezone(timezone)
         self.scopes = scopes
         self.token_path = os.path.join(_pycof_folders("data"), "token.pickle") if token_path is None else token_path
@@ -552,6 +552,9 @@ class GoogleCalendar:
         :return: Google calendar credentials.
         :rtype: :obj:`google_auth_oauthlib`
         """
+        from google.auth.transport.requests import Request
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
         creds = None
         # The file token.pickle stores the user's access and refresh tokens, and is
         # created automatically when the authorization flow completes for the first
@@ -581,6 +584,9 @@ class GoogleCalendar:
         :return: Data Frame with all retreived events.
         :rtype: :obj:`pandas.DataFrame`
         """
+        import pandas as pd
+        from dateparser import parse
+
         events_df = pd.DataFrame()
 
         if not events:
@@ -609,6 +615,8 @@ class GoogleCalendar:
         :return: Data Frame with all events for today.
         :rtype: :obj:`pandas.DataFrame`
         """
+        from googleapiclient.discovery import build
+
         # Call the Calendar API
         service = build("calendar", "v3", credentials=self._get_creds())
 
@@ -651,6 +659,9 @@ class GoogleCalendar:
         :return: Data Frame with future events.
         :rtype: :obj:`pandas.DataFrame`
         """
+        from dateparser import parse
+        from googleapiclient.discovery import build
+
         # Call the Calendar API
         service = build("calendar", "v3", credentials=self._get_creds())
 
@@ -680,6 +691,8 @@ class GoogleCalendar:
         :return: List of all available calendars.
         :rtype: :obj:`list`
         """
+        from googleapiclient.discovery import build
+
         service = build("calendar", "v3", credentials=self._get_creds())
 
         return service.calendarList().list().execute()
@@ -723,6 +736,11 @@ def GetEmails(nb_email=1, email_address="", port=993, credentials={}):
     :return: Data frame with last emails.
     :rtype: :obj:`pandas.DataFrame`
     """
+    import dateparser
+    import numpy as np
+    import pandas as pd
+    from dateutil import tz
+
     # Getting configs
     config = _get_config(credentials)
 
@@ -1,21 +1,20 @@
 import datetime
 import getpass
+import io
 import json
 import logging
 import os
 import smtplib
 import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from io import BytesIO, StringIO
 
-import boto3
 import colorlog
-import numpy as np
-import pandas as pd
-import sshtunnel
-from botocore.exceptions import ProfileNotFound
-from tqdm import tqdm
 
 ########################################################################################################################
 # Get config file
@@ -39,7 +38,7 @@ def _pycof_folders(output=None, verbose=False):
     # Credentials folder
     if not os.path.exists(creds_fold):
         try:
-            os.makedirs(creds_fold)
+            os.makedirs(creds_fold, exist_ok=True)
             _created += 1
         except PermissionError as err:
             raise PermissionError(f"""Could not create the PYCOF config folder, permission denied: {creds_fold}.
@@ -49,7 +48,7 @@ def _pycof_folders(output=None, verbose=False):
     folds_q = os.path.join(temp_path, "pycof", "cache", "queries") + os.sep
     if not os.path.exists(folds_q):
         try:
-            os.makedirs(folds_q)
+            os.makedirs(folds_q, exist_ok=True)
             _created += 1
         except PermissionError as err:
             raise PermissionError(f"""Could not create the PYCOF temp folder, permission denied: {folds_q}.
@@ -59,7 +58,7 @@ def _pycof_folders(output=None, verbose=False):
     folds_d = os.path.join(temp_path, "pycof", "cache", "data") + os.sep
     if not os.path.exists(folds_d):
         try:
-            os.makedirs(folds_d)
+            os.makedirs(folds_d, exist_ok=True)
             _created += 1
         except PermissionError as err:
             raise PermissionError(f"""Could not create the PYCOF temp data folder, permission denied: {folds_d}.
@@ -69,7 +68,7 @@ def _pycof_folders(output=None, verbose=False):
     folds_s3 = os.path.join(temp_path, "pycof", "cache", "s3") + os.sep
     if not os.path.exists(folds_s3):
         try:
-            os.makedirs(folds_s3)
+            os.makedirs(folds_s3, exist_ok=True)
             _created += 1
         except PermissionError as err:
             raise PermissionError(f"""Could not create the PYCOF temp s3 folder, permission denied: {folds_s3}.
@@ -79,7 +78,7 @@ def _pycof_folders(output=None, verbose=False):
     folds_models = os.path.join(temp_path, "pycof", "cache", "models") + os.sep
     if not os.path.exists(folds_models):
         try:
-            os.makedirs(folds_models)
+            os.makedirs(folds_models, exist_ok=True)
             _created += 1
         except PermissionError as err:
             raise PermissionError(f"""Could not create the PYCOF temp models folder, permission denied: {folds_models}.
@@ -141,15 +140,324 @@ def _get_config(credentials={}):
     return config
 
 
+########################################################################################################################
+# AWS sessions and clients
+
+_AWS_LOCK = threading.Lock()
+# (profile, access key, secret key, session token, region) -> boto3 session
+_AWS_SESSIONS = {}
+# (service, profile, access key, secret key, session token, region, connection pool size) -> boto3 client
+_AWS_CLIENTS = {}
+
+
+def _aws_session(profile_name=None, access_key=None, secret_key=None, session_token=None, region=None):
+    """boto3 session shared by all PYCOF calls with the same profile, credentials and region.
+    Creating a session resolves the credentials chain, which is slow, so sessions are only created once.
+    """
+    import boto3
+
+    key = (profile_name, access_key, secret_key, session_token, region)
+    with _AWS_LOCK:
+        if key not in _AWS_SESSIONS:
+            _AWS_SESSIONS[key] = boto3.session.Session(
+                profile_name=profile_name,
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_key,
+                aws_session_token=session_token,
+                region_name=region,
+            )
+        return _AWS_SESSIONS[key]
+
+
+def _aws_client(
+    service,
+    profile_name=None,
+    access_key=None,
+    secret_key=None,
+    session_token=None,
+    region=None,
+    max_pool_connections=None,
+):
+    """boto3 client shared between calls and threads (clients are thread-safe), created on first use.
+    Clients used by many threads at once need :obj:`max_pool_connections` HTTP connections (botocore keeps 10).
+    """
+    from botocore.config import Config
+
+    key = (service, profile_name, access_key, secret_key, session_token, region, max_pool_connections)
+    with _AWS_LOCK:
+        client = _AWS_CLIENTS.get(key)
+    if client is None:
+        session = _aws_session(profile_name, access_key, secret_key, session_token, region)
+        config = None if max_pool_connections is None else Config(max_pool_connections=max_pool_connections)
+        with _AWS_LOCK:
+            # Sessions are not thread-safe, clients are created one at a time
+            client = _AWS_CLIENTS.setdefault(key, session.client(service, config=config))
+    return client
+
+
+def _s3_credentials(profile_name=None, credentials={}):
+    """Arguments of :py:meth:`_aws_session` for S3: the AWS profile, or the keys from the PYCOF config if the profile
+    does not exist.
+    """
+    from botocore.exceptions import ProfileNotFound
+
+    try:
+        _aws_session(profile_name=profile_name)
+        return {"profile_name": profile_name}
+    except ProfileNotFound:
+        config = _get_config(credentials)
+        return {
+            "access_key": config.get("AWS_ACCESS_KEY_ID"),
+            "secret_key": config.get("AWS_SECRET_ACCESS_KEY"),
+            "region": config.get("REGION"),
+        }
+    except FileNotFoundError:
+        raise ConnectionError(
+            "Please run 'aws config' on your terminal and initialize the parameters or profide a correct value for crendetials."
+        )
+
+
+# bucket -> region of the bucket, None if it could not be resolved
+_S3_REGIONS = {}
+# (boto3 session, region) -> (frozen credentials, pyarrow S3 filesystem)
+_S3_FILESYSTEMS = {}
+
+
+def _s3_filesystem(session, bucket):
+    """:obj:`pyarrow.fs.S3FileSystem` with the credentials of a boto3 session, shared by all calls with the same
+    session, region and credentials. Temporary credentials (assumed roles, SSO, instance roles) are refreshed by boto3
+    before they expire, the filesystem is then created again with the new ones. The region of the bucket is only
+    resolved once when the session has no region.
+    """
+    from pyarrow import fs
+
+    region = session.region_name
+    if region is None:
+        with _AWS_LOCK:
+            resolved = bucket in _S3_REGIONS
+            region = _S3_REGIONS.get(bucket)
+        if not resolved:
+            try:
+                region = fs.resolve_s3_region(bucket)
+            except OSError:
+                pass
+            with _AWS_LOCK:
+                _S3_REGIONS[bucket] = region
+    credentials = session.get_credentials()
+    # Refreshes the credentials if they are about to expire
+    frozen = credentials.get_frozen_credentials() if credentials is not None else None
+    key = (session, region)
+    with _AWS_LOCK:
+        cached = _S3_FILESYSTEMS.get(key)
+    if (cached is not None) and (cached[0] == frozen):
+        return cached[1]
+    filesystem = fs.S3FileSystem(
+        access_key=frozen.access_key if frozen else None,
+        secret_key=frozen.secret_key if frozen else None,
+        session_token=frozen.token if frozen else None,
+        region=region,
+    )
+    with _AWS_LOCK:
+        _S3_FILESYSTEMS[key] = (frozen, filesystem)
+    return filesystem
+
+
+########################################################################################################################
+# Streaming multipart uploads to S3
+
+# S3 rejects parts smaller than 5MB, except for the last one
+_MIN_PART_SIZE = 5 * 1024**2
+
+
+class _S3MultipartWriter(io.RawIOBase):
+    """Binary file object uploading what is written to S3 as a multipart upload.
+    Data is buffered until a part is full, parts are then uploaded in parallel while the next ones are encoded.
+    At most `max_workers + 1` parts are held in memory at once; writers block until a part has been uploaded.
+    Objects smaller than one part are sent with a single PUT. The upload is aborted as soon as a part fails
+    or if the writer is closed after an error, so no incomplete upload is left behind.
+
+    :Parameters:
+        * **s3** (:obj:`boto3.client`): S3 client.
+        * **bucket** (:obj:`str`): Bucket to write to.
+        * **key** (:obj:`str`): Key of the object.
+        * **part_size** (:obj:`int`): Size of the parts in bytes (defaults 16MB).
+        * **max_workers** (:obj:`int`): Number of parts uploaded in parallel (defaults 4).
+    """
+
+    def __init__(self, s3, bucket, key, part_size=16 * 1024**2, max_workers=4):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.max_workers = max_workers
+        self.upload_id = None
+        self._buffer = bytearray()
+        self._futures = []
+        self._pool = None
+        self._slots = threading.BoundedSemaphore(max_workers + 1)
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._check()
+        self._buffer.extend(b)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[: self.part_size])
+            del self._buffer[: self.part_size]
+            self._upload(part)
+        return len(b)
+
+    def _check(self):
+        # Stop writing on the first part that failed instead of encoding the rest of the data
+        for future in self._futures:
+            if future.done() and (future.exception() is not None):
+                error = future.exception()
+                self.abort()
+                raise error
+
+    def _upload(self, part):
+        if self.upload_id is None:
+            self.upload_id = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key)["UploadId"]
+            self._pool = ThreadPoolExecutor(self.max_workers)
+        # Wait for a slot so that no more than max_workers + 1 parts are kept in memory
+        self._slots.acquire()
+        try:
+            self._check()
+        except BaseException:
+            self._slots.release()
+            raise
+        number = len(self._futures) + 1
+        future = self._pool.submit(
+            self.s3.upload_part,
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=number,
+            Body=part,
+        )
+        future.add_done_callback(lambda f: self._slots.release())
+        self._futures.append(future)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.upload_id is None:
+                self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer))
+            else:
+                if self._buffer:
+                    self._upload(bytes(self._buffer))
+                parts = [{"ETag": f.result()["ETag"], "PartNumber": i + 1} for i, f in enumerate(self._futures)]
+                self.s3.complete_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": parts}
+                )
+        except BaseException:
+            self.abort()
+            raise
+        finally:
+            self._buffer = bytearray()
+            if self._pool is not None:
+                self._pool.shutdown()
+            super().close()
+
+    def abort(self):
+        """Cancel the pending parts and abort the multipart upload."""
+        for future in self._futures:
+            future.cancel()
+        if self._pool is not None:
+            self._pool.shutdown()
+        if self.upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            self.upload_id = None
+        self._buffer = bytearray()
+        super().close()
+
+
+########################################################################################################################
+# Data frame formats
+
+# Data frame formats by file extension, shared by read and write
+_DATA_FORMATS = {
+    "csv": "csv",
+    "txt": "csv",
+    "parq": "parquet",
+    "parquet": "parquet",
+    "fea": "feather",
+    "feather": "feather",
+    "arrow": "arrow-ipc",
+    "ipc": "arrow-ipc",
+    "xls": "excel",
+    "xlsx": "excel",
+    "json": "json",
+    "jsonl": "ndjson",
+    "ndjson": "ndjson",
+}
+
+
+# Extensions pandas can read but not write (xlwt was removed from pandas)
+_READ_ONLY_EXTENSIONS = ["xls"]
+
+
+def _data_format(path, extension=None):
+    """Data frame format of a path, from its extension or the extension provided. None if not a data frame format."""
+    ext = path.split(".")[-1] if extension is None else extension
+    return _DATA_FORMATS.get(ext.lower())
+
+
+def _write_feather(df, out, **kwargs):
+    from pyarrow import feather
+
+    feather.write_feather(df, out, **kwargs)
+
+
+def _write_arrow_ipc(df, out, compression=None, index=None, chunksize=None):
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=index)
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+    with pa.ipc.new_file(out, table.schema, options=options) as writer:
+        writer.write_table(table, max_chunksize=chunksize)
+
+
+# Writers of the data frame formats, to a path or a binary file object
+_WRITERS = {
+    "csv": lambda df, out, **kwargs: df.to_csv(out, **kwargs),
+    "parquet": lambda df, out, **kwargs: df.to_parquet(out, **kwargs),
+    "feather": _write_feather,
+    "arrow-ipc": _write_arrow_ipc,
+    "excel": lambda df, out, **kwargs: df.to_excel(out, **kwargs),
+    "json": lambda df, out, **kwargs: df.to_json(out, **kwargs),
+    "ndjson": lambda df, out, **kwargs: df.to_json(out, **{"orient": "records", "lines": True, **kwargs}),
+}
+
+
 ########################################################################################################################
 # Write to a txt file
 
 
-def write(file, path, perm="a", verbose=False, end_row="\n", credentials={}, profile_name=None, **kwargs):
+def write(
+    file,
+    path,
+    perm="a",
+    verbose=False,
+    end_row="\n",
+    credentials={},
+    profile_name=None,
+    part_size=16 * 1024**2,
+    max_workers=4,
+    partition_cols=None,
+    max_rows_per_file=None,
+    **kwargs,
+):
     """Write a line of text into a file (usually .txt) or saves data objects.
     As opposed to Pandas' built-in functions (:obj:`to_csv` or :obj:`to_parquet`), this function allows to pass AWS IAM credentials similar to
     :py:meth:`pycof.sql.remote_execute_sql`.
 
+    Data frames written to S3 are encoded straight into a multipart upload: the parts are uploaded in parallel while the
+    next ones are encoded, so at most `(max_workers + 1) * part_size` bytes are buffered, and objects larger than 5GB
+    can be written.
+
     :Parameters:
         * **file** (:obj:`str` or :obj:`pandas.DataFrame`): Line of text or object to be inserted in the file.
         * **path** (:obj:`str`): File on which to write (`/path/to/file.txt`). Can be any format, not necessarily txt.
@@ -158,63 +466,70 @@ def write(file, path, perm="a", verbose=False, end_row="\n", credentials={}, pro
         * **end_row** (:obj:`str`): Character to end the row (defaults '\\n').
         * **credentials** (:obj:`dict`): Credentials to use to connect to AWS S3. You can also provide the credentials path or the json file name from '/etc/' (defaults {}).
         * **profile_name** (:obj:`str`): Profile name of the AWS profile configured with the command `aws configure` (defaults None).
-        * **\\*\\*kwargs** (:obj:`str`): Arguments to be passed to pandas function (either :obj:`to_csv` or :obj:`to_parquet`).
+        * **part_size** (:obj:`int`): Size in bytes of the parts of S3 multipart uploads, at least 5MB (defaults 16MB).
+        * **max_workers** (:obj:`int`): Number of parts uploaded to S3 in parallel (defaults 4).
+        * **partition_cols** (:obj:`list`): Columns to partition the data frame on. The data is then written as a hive-partitioned parquet dataset in the folder `path`, with one sub-folder per value (`path/country=FR/`) (defaults None).
+        * **max_rows_per_file** (:obj:`int`): Maximum number of rows per file. If set, the data frame is written as a parquet dataset in the folder `path`, split in several files (defaults None).
+        * **\\*\\*kwargs** (:obj:`str`): Arguments to be passed to the writer of the format (pandas :obj:`to_csv`, :obj:`to_parquet`, :obj:`to_excel` or :obj:`to_json`, :obj:`pyarrow.feather.write_feather`). Arrow IPC files accept :obj:`compression` ('lz4' or 'zstd') and :obj:`chunksize`.
 
     :Example:
         >>> pycof.write('This is a test', path='~/pycof_test_write.txt', perm='w')
         >>> pycof.write(df, path='s3://bucket/path/to/file.parquet', credentials='config.json')
+        >>> pycof.write(df, path='s3://bucket/path/to/file.arrow', compression='lz4')
+        >>> pycof.write(df, path='s3://bucket/path/to/folder', partition_cols=['country'], perm='w')
 
     :Returns:
         * :obj:`int`: Number of characters inserted if verbose is True.
     """
+    import pandas as pd
+
     # Check if path provided is S3
     useIAM = path.startswith("s3://")
 
-    if useIAM:
-        # If S3, try AWS cli profile or credentials
-        try:
-            sess = boto3.session.Session(profile_name=profile_name)
-            s3 = sess.client("s3")
-            s3_resource = sess.resource("s3")
-        except ProfileNotFound:
-            config = _get_config(credentials)
-            s3 = boto3.client(
-                "s3",
-                aws_access_key_id=config.get("AWS_ACCESS_KEY_ID"),
-                aws_secret_access_key=config.get("AWS_SECRET_ACCESS_KEY"),
-                region_name=config.get("REGION"),
-            )
-            s3_resource = boto3.resource(
-                "s3",
-                aws_access_key_id=config.get("AWS_ACCESS_KEY_ID"),
-                aws_secret_access_key=config.get("AWS_SECRET_ACCESS_KEY"),
-                region_name=config.get("REGION"),
-            )
-        except FileNotFoundError:
-            raise ConnectionError(
-                "Please run 'aws config' on your terminal and initialize the parameters or profide a correct value for crendetials."
-            )
-
+    # If S3, try AWS cli profile or credentials
+    aws = _s3_credentials(profile_name, credentials) if useIAM else None
+
+    # Partitioned parquet dataset
+    if isinstance(file, pd.DataFrame) and (partition_cols or max_rows_per_file):
+        _write_dataset(
+            file,
+            path,
+            perm=perm,
+            partition_cols=partition_cols,
+            max_rows_per_file=max_rows_per_file,
+            aws=aws,
+            **kwargs,
+        )
     # Pandas DataFrame
-    if isinstance(file, pd.DataFrame):
-        # CSV or TXT
-        if path.endswith(".csv") or path.endswith(".txt"):
-            out_buffer = StringIO() if useIAM else path
-            file.to_csv(out_buffer, **kwargs)
-        # Parquet
-        elif path.endswith(".parquet"):
-            out_buffer = BytesIO() if useIAM else path
-            file.to_parquet(out_buffer, **kwargs)
-        # Json
-        elif path.endswith(".json"):
-            out_buffer = StringIO() if useIAM else path
-            file.to_json(out_buffer, **kwargs)
-
-        # If S3, push to bucket
+    elif isinstance(file, pd.DataFrame):
+        fmt = _data_format(path)
+        if (fmt not in _WRITERS) or (path.split(".")[-1].lower() in _READ_ONLY_EXTENSIONS):
+            extensions = [ext for ext in _DATA_FORMATS if ext not in _READ_ONLY_EXTENSIONS]
+            raise ValueError(
+                f"Cannot write a data frame to {path}, the extension must be one of {', '.join(extensions)}"
+            )
         if useIAM:
             bucket = path.replace("s3://", "").split("/")[0]
             folder_path = "/".join(path.replace("s3://", "").split("/")[1:])
-            s3_resource.Object(bucket, folder_path).put(Body=out_buffer.getvalue())
+            out_buffer = _S3MultipartWriter(
+                _aws_client("s3", **aws),
+                bucket,
+                folder_path,
+                part_size=max(part_size, _MIN_PART_SIZE),
+                max_workers=max_workers,
+            )
+        else:
+            out_buffer = path
+        try:
+            _WRITERS[fmt](file, out_buffer, **kwargs)
+        except BaseException:
+            if useIAM:
+                out_buffer.abort()
+            raise
+
+        # If S3, complete the upload
+        if useIAM:
+            out_buffer.close()
     # Other input file format
     else:
         if useIAM:
@@ -232,12 +547,46 @@ def write(file, path, perm="a", verbose=False, end_row="\n", credentials={}, pro
                 f.write(file + end_row)
 
         if useIAM:
-            s3.upload_file(path, bucket, folder_path)
+            _aws_client("s3", **aws).upload_file(path, bucket, folder_path)
 
     if verbose:
         return len(file)
 
 
+def _write_dataset(file, path, perm="a", partition_cols=None, max_rows_per_file=None, aws=None, **kwargs):
+    """Write a data frame as a parquet dataset with :obj:`pyarrow.dataset.write_dataset`, locally or on S3 when `aws`
+    holds the arguments of :py:meth:`_aws_session`. Files are encoded and written in parallel.
+    With `perm='w'` the partitions written replace the existing ones, otherwise new files are added next to them.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    if aws is not None:
+        bucket = path.replace("s3://", "").split("/")[0]
+        filesystem = _s3_filesystem(_aws_session(**aws), bucket)
+        path = path.replace("s3://", "")
+    else:
+        filesystem = None
+    table = pa.Table.from_pandas(file, preserve_index=kwargs.pop("index", None))
+    options = ds.ParquetFileFormat().make_write_options(compression=kwargs.pop("compression", "snappy"))
+    if max_rows_per_file:
+        kwargs.setdefault("max_rows_per_group", min(max_rows_per_file, 1024**2))
+    kwargs.setdefault("existing_data_behavior", "delete_matching" if perm == "w" else "overwrite_or_ignore")
+    # Unique file names so that appending does not overwrite the files of previous writes
+    kwargs.setdefault("basename_template", f"part-{uuid.uuid4().hex}-{{i}}.parquet")
+    ds.write_dataset(
+        table,
+        path,
+        format="parquet",
+        filesystem=filesystem,
+        partitioning=partition_cols,
+        partitioning_flavor="hive" if partition_cols else None,
+        max_rows_per_file=max_rows_per_file or 0,
+        file_options=options,
+        **kwargs,
+    )
+
+
 ########################################################################################################################
 # Compute the age of a given file
 
@@ -299,6 +648,8 @@ def verbose_display(element, verbose=True, sep=" ", end="\n", return_list=False)
         :obj:`str`: The element to be displayed.
     """
     if (verbose in [1, True]) & (type(element) in [list, range]) & (return_list is False):
+        from tqdm import tqdm
+
         return tqdm(element)
     elif (verbose in [1, True]) & (type(element) in [list]) & (return_list is True):
         return print(*element, sep=sep, end=end)
@@ -310,15 +661,79 @@ def verbose_display(element, verbose=True, sep=" ", end="\n", return_list=False)
         return element
 
 
+# #######################################################################################################################
+# File locks and atomic writes
+
+
+@contextmanager
+def _file_lock(path, blocking=True):
+    """Exclusive lock on a file, shared between processes and threads, held while in the context.
+    The context returns whether the lock is acquired (always True if :obj:`blocking`).
+    """
+    with open(path, "a+b") as lock_file:
+        fd = lock_file.fileno()
+        if sys.platform in ["win32", "win64", "cygwin", "msys"]:
+            import msvcrt
+
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                    acquired = True
+                except OSError:
+                    acquired = False
+                if acquired or not blocking:
+                    break
+                time.sleep(0.05)
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    lock_file.seek(0)
+                    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                acquired = True
+            except BlockingIOError:
+                acquired = False
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+@contextmanager
+def _atomic_path(path):
+    """Temporary path to write a file to, renamed as :obj:`path` once the context exits without error.
+    Readers then either see the previous version of the file or the new one, never a partially written file.
+    """
+    folder, name = os.path.split(path)
+    # Keep the extension at the end of the name so that the format is still detected from the path
+    tmp_path = os.path.join(folder, f".{uuid.uuid4().hex}.{name}")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
 # #######################################################################################################################
 # Fake SSH tunnel for direct connections
 
 
 class _fake_tunnel:
-    def __init__():
-        pass
+    """Tunnel of direct connections, only holding the function opening the database connection.
+    Each :obj:`SSHTunnel` gets its own instance so that concurrent calls never share a connector.
+    """
 
-    def close():
+    def __init__(self, connector=None):
+        self.connector = connector
+
+    def close(self):
         pass
 
 
@@ -332,6 +747,8 @@ class EmailSSHTunnel:
 
     def __enter__(self):
         if self.connection == "ssh":
+            import sshtunnel
+
             try:
                 ssh_port = 22 if self.config.get("SSH_PORT") is None else int(self.config.get("SSH_PORT"))
                 remote_addr = (
@@ -372,8 +789,7 @@ class EmailSSHTunnel:
             except Exception as e:
                 raise ConnectionError(f"Failed to establish SSH connection with host: {str(e)}")
         else:
-            self.tunnel = _fake_tunnel
-            self.tunnel.connector = self._define_connector
+            self.tunnel = _fake_tunnel(self._define_connector)
 
         return self.tunnel
 
@@ -1,9 +1,11 @@
+import concurrent.futures
 import datetime
 import getpass
 import os
 import re
 import sys
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pandas as pd
@@ -12,11 +14,16 @@ from tqdm import tqdm
 from .data import read, write
 from .format import file_age, verbose_display
 from .sqlhelper import (
+    _POOL,
     SSHTunnel,
     _cache,
+    _checkout,
+    _connection_uri,
     _get_config,
     _get_credentials,
     _insert_data,
+    _read_sql,
+    _stream_sql,
     create_ssh_tunnel,
 )
 
@@ -43,6 +50,19 @@ def remote_execute_sql(
     cache=False,
     cache_name=None,
     cache_folder=None,
+    cache_key=None,
+    incremental_column=None,
+    stale_while_revalidate=None,
+    params=None,
+    chunksize=None,
+    stream=False,
+    pool=False,
+    backend="pandas",
+    insert_method="executemany",
+    batch_size=10000,
+    workers=1,
+    single_transaction=False,
+    multi_row=False,
     *args,
     **kwargs,
 ):
@@ -59,8 +79,21 @@ def remote_execute_sql(
         * **verbose** (:obj:`bool`): Display progression bar (defaults True).
         * **connection** (:obj:`str`): Type of connection to establish. Can either be 'direct', 'IAM' or 'SSH' (defaults 'direct').
         * **autofill_nan** (:obj:`bool`): Replace NaN values by 'NULL' (defaults True).
-        * **cache** (:obj:`str`): Caches the data to avoid running again the same SQL query (defaults False). Provide a :obj:`str` for the cache time.
-        * **cache_name** (:obj:`str`): File name for storing cache data, if None the name will be generated by hashing the SQL (defaults None).
+        * **cache** (:obj:`str`): Caches the data to avoid running again the same SQL query (defaults False). Provide a :obj:`str` for the cache time. Cached outputs are also kept in memory for repeated calls, see :py:meth:`pycof.cache.configure`.
+        * **cache_name** (:obj:`str`): File name for storing cache data, if None the name will be generated by hashing the normalized SQL, see :py:meth:`pycof.cache.fingerprint` (defaults None).
+        * **incremental_column** (:obj:`str`): Column of an append-only query (e.g. a timestamp or an increasing id) used to refresh the cache incrementally. Once the cache expires, only rows with a value greater than the last cached one are queried and appended to the cached data (defaults None).
+        * **stale_while_revalidate** (:obj:`str`): Window after the cache time during which the expired cached data are returned right away while the query runs again in a background thread, e.g. '1h'. Failures of the background refresh are logged (defaults None).
+        * **params** (:obj:`list` or :obj:`dict`): Bind parameters of the query, passed to the database driver. Use the placeholders of the driver: :obj:`%s` or :obj:`%(name)s` for Redshift, Postgres and MySQL, :obj:`?` or :obj:`:name` for SQLite. With :obj:`pool=True`, queries with parameters are prepared once per connection on Postgres and Redshift (defaults None).
+        * **cache_key** (:obj:`callable`): Function returning the cache key of the SQL query, to share cached data between queries known to be identical (defaults None, uses :py:meth:`pycof.cache.fingerprint`).
+        * **chunksize** (:obj:`int`): Number of rows per batch when streaming the output of a SELECT query. Providing a value enables :obj:`stream` (defaults None).
+        * **stream** (:obj:`bool`): Return a generator of :obj:`pandas.DataFrame` batches read from a server-side cursor instead of loading the whole output in memory (defaults False).
+        * **backend** (:obj:`str`): Format of the output of SELECT queries. Can either be 'pandas' for a :obj:`pandas.DataFrame`, 'arrow' for a :obj:`pandas.DataFrame` with Arrow-backed dtypes or 'pyarrow' for a :obj:`pyarrow.Table`. Arrow backends fetch data with `connectorx <https://github.com/sfu-db/connector-x>`_ if installed (not through SSH tunnels), or convert batches from a server-side cursor. Cached data are written and read as Arrow tables (defaults 'pandas').
+        * **insert_method** (:obj:`str`): Method to INSERT data. Either 'executemany' to push batches of 10k rows or 'copy' to bulk load the data with :obj:`COPY ... FROM STDIN` on Postgres, :obj:`LOAD DATA LOCAL INFILE` on MySQL (requires :obj:`local_infile` to be enabled on the server) or a single transaction on SQLite (defaults 'executemany').
+        * **batch_size** (:obj:`int`): Number of rows sent per statement on INSERT (defaults 10000).
+        * **workers** (:obj:`int`): Number of threads, each with its own connection through the same tunnel, sending the INSERT batches in parallel. Ignored for SQLite (defaults 1).
+        * **single_transaction** (:obj:`bool`): Commit the INSERT once all batches are sent instead of after each batch. Requires :obj:`workers=1` (defaults False).
+        * **multi_row** (:obj:`bool`): Send each INSERT batch as a single statement with multiple :obj:`VALUES (...), (...)` rather than with :obj:`executemany`, which sends rows one by one with psycopg2 (defaults False).
+        * **pool** (:obj:`bool`): Keep the SSH tunnel and the database connection open in a process-wide pool to reuse them in the next calls with the same host, port, user, database, engine and connection type. Idle connections are closed after 5 minutes (or :obj:`PYCOF_POOL_TIMEOUT` seconds) or with :py:meth:`pycof.sql.close_all` (defaults False).
         * **\\*\\*kwargs** (:obj:`str`): Arguments to be passed to the :py:meth:`pycof.data.read` function.
 
     .. warning:: Since version 1.2.0, argument :obj:`useIAM` is replaced by :obj:`connection`.
@@ -100,9 +133,15 @@ def remote_execute_sql(
 
     :Example:
         >>> df = pycof.remote_execute_sql("SELECT * FROM SCHEMA.TABLE LIMIT 10")
+        >>> for batch in pycof.remote_execute_sql("SELECT * FROM SCHEMA.TABLE", chunksize=50000):
+        ...     process(batch)
+        >>> df = pycof.remote_execute_sql("SELECT * FROM SCHEMA.TABLE WHERE country = %s", params=["FR"], pool=True)
 
     :Returns:
         * :obj:`pandas.DataFrame`: Result of an SQL query if :obj:`query_type = "SELECT"`.
+        * :obj:`pyarrow.Table`: Result of an SQL query if :obj:`backend="pyarrow"`, metadata below are not available.
+        * :obj:`generator`: Batches of :obj:`pandas.DataFrame` if :obj:`stream=True` or :obj:`chunksize` is provided.
+          The SSH tunnel and the connection remain open until the generator is exhausted or closed.
 
         Metadata are also available to users with addtionnal information regarding the SQL query and the file.
 
@@ -155,23 +194,37 @@ def remote_execute_sql(
     # ============================================================================================
     # Credentials load
     config = _get_credentials(_get_config(credentials), profile_name=profile_name, connection=connection)
+    if (sql_type.upper() == "INSERT") & (insert_method == "copy"):
+        # Allow the MySQL client to send local files with LOAD DATA LOCAL INFILE
+        config = dict(config, DB_LOCAL_INFILE=True)
+
+    # ============================================================================================
+    # Set default value for table
+    if sql_type == "SELECT":  # SELECT
+        if table == "":  # If the table is not specified, we get it from the SQL query
+            table = sql_query.upper().replace("\n", " ").split("FROM ")[1].split(" ")[0]
+        elif (sql_type == "SELECT") & (table.upper() in sql_query.upper()):
+            table = table
+        else:
+            raise SyntaxError("Argument table does not match with SQL statement")
+
+    # ============================================================================================
+    # SELECT - Stream the output by batches, the generator keeps the tunnel open until it is exhausted
+    if (sql_type.upper() == "SELECT") & (stream or (chunksize is not None)):
+        if cache:
+            raise ValueError("Streamed results cannot be cached, use either cache or stream/chunksize")
+        tunnel = create_ssh_tunnel(config=config, connection=connection, engine=engine, pool=pool)
+        return _stream_sql(sql_query, tunnel, chunksize=10000 if chunksize is None else int(chunksize), params=params)
+
+    # Columnar drivers connect on their own, which is only possible without SSH tunnel
+    uri = _connection_uri(config, engine=engine) if (backend != "pandas") & (connection.lower() != "ssh") else None
 
     # ============================================================================================
     # Start the connection
-    with create_ssh_tunnel(config=config, connection=connection, engine=engine) as tunnel:
+    with create_ssh_tunnel(config=config, connection=connection, engine=engine, pool=pool) as tunnel:
         # ============================================================================================
         # Database connector
 
-        # ============================================================================================
-        # Set default value for table
-        if sql_type == "SELECT":  # SELECT
-            if table == "":  # If the table is not specified, we get it from the SQL query
-                table = sql_query.upper().replace("\n", " ").split("FROM ")[1].split(" ")[0]
-            elif (sql_type == "SELECT") & (table.upper() in sql_query.upper()):
-                table = table
-            else:
-                raise SyntaxError("Argument table does not match with SQL statement")
-
         # ========================================================================================
         # SELECT - Read query
         if sql_type.upper() == "SELECT":
@@ -184,34 +237,168 @@ def remote_execute_sql(
                     verbose=verbose,
                     cache_file_name=cache_name,
                     cache_folder=cache_folder,
+                    backend=backend,
+                    uri=uri,
+                    cache_key=cache_key,
+                    params=params,
+                    incremental_column=incremental_column,
+                    stale_while_revalidate=stale_while_revalidate,
+                    # The background refresh outlives the tunnel of this call
+                    tunnel_factory=lambda: create_ssh_tunnel(
+                        config=config, connection=connection, engine=engine, pool=pool
+                    ),
                 )
             else:
-                conn = tunnel.connector()
-                sql_out = pd.read_sql(sql_query, conn, coerce_float=False)
-                # Close SQL connection
-                conn.close()
+                # The connection is closed, or given back to the pool, even if the query fails
+                with _checkout(tunnel) as conn:
+                    if backend == "pandas":
+                        sql_out = _read_sql(sql_query, conn, params=params, coerce_float=False)
+                    else:
+                        sql_out = _read_sql(sql_query, conn, backend=backend, uri=uri, params=params)
             return sql_out
         # ============================================================================================
         # INSERT - Load data to the db
         elif sql_type.upper() == "INSERT":
-            conn = tunnel.connector()
-            _insert_data(data=data, table=table, connector=conn, autofill_nan=autofill_nan, verbose=verbose)
+            with _checkout(tunnel) as conn:
+                _insert_data(
+                    data=data,
+                    table=table,
+                    connector=conn,
+                    autofill_nan=autofill_nan,
+                    verbose=verbose,
+                    method=insert_method,
+                    batch_size=batch_size,
+                    workers=workers,
+                    single_transaction=single_transaction,
+                    multi_row=multi_row,
+                    connector_factory=tunnel.connector,
+                )
 
         # ============================================================================================
         # DELETE / COPY / UNLOAD - Execute SQL command which does not return output
         elif sql_type.upper() in ["CREATE", "GRANT", "DELETE", "COPY", "UNLOAD", "UPDATE"]:
             if table.upper() in sql_query.upper():
-                conn = tunnel.connector()
-                cur = conn.cursor()
-                cur.execute(sql_query)
-                conn.commit()
+                with _checkout(tunnel) as conn:
+                    cur = conn.cursor()
+                    if params is None:
+                        cur.execute(sql_query)
+                    else:
+                        cur.execute(sql_query, params)
+                    conn.commit()
             else:
                 raise ValueError("Table does not match with SQL query")
         else:
             raise ValueError(f"Unknown query_type, should be as: {all_query_types}")
 
-        # Close SQL connection
-        conn.close()
+
+#######################################################################################################################
+
+
+# Run several queries concurrently
+def execute_many_sql(
+    queries,
+    max_workers=8,
+    credentials={},
+    profile_name=None,
+    connection="direct",
+    cache=False,
+    errors="raise",
+    as_completed=False,
+    verbose=False,
+    **kwargs,
+):
+    """Execute several independent SQL queries concurrently with :py:meth:`pycof.sql.remote_execute_sql`.
+    Credentials are loaded once and queries share the SSH tunnel and the connections of the connection pool.
+    Cached queries use the same cache as :py:meth:`pycof.sql.remote_execute_sql`.
+
+    :Parameters:
+        * **queries** (:obj:`list` or :obj:`dict`): SQL queries to execute. A :obj:`dict` allows to name the queries.
+        * **max_workers** (:obj:`int`): Maximum number of queries running at the same time (defaults 8).
+        * **credentials** (:obj:`dict`): Credentials to use to connect to the database, see :py:meth:`pycof.sql.remote_execute_sql` (defaults {}).
+        * **profile_name** (:obj:`str`): Profile name of the AWS profile in case of :obj:`connection='IAM'` (defaults None).
+        * **connection** (:obj:`str`): Type of connection to establish. Can either be 'direct', 'IAM' or 'SSH' (defaults 'direct').
+        * **cache** (:obj:`str`): Caches the data to avoid running again the same SQL query, see :py:meth:`pycof.sql.remote_execute_sql` (defaults False).
+        * **errors** (:obj:`str`): What to do when a query fails. Can either be 'raise' to raise the error and cancel the queries not started yet, 'return' to return the exception instead of the query's output or 'ignore' to return None (defaults 'raise').
+        * **as_completed** (:obj:`bool`): Return a generator of (query key, output) tuples in the order queries complete instead of all outputs in the order of the queries. Queries start on the first iteration and the ones not started are cancelled when the generator is closed (defaults False).
+        * **verbose** (:obj:`bool`): Display a progression bar (defaults False).
+        * **\\*\\*kwargs** (:obj:`str`): Arguments to be passed to :py:meth:`pycof.sql.remote_execute_sql`, queries always use the connection pool (:obj:`pool` is ignored).
+
+    :Example:
+        >>> queries = {c: f"SELECT * FROM SCHEMA.TABLE WHERE country = '{c}'" for c in ["FR", "US", "UK"]}
+        >>> dfs = pycof.execute_many_sql(queries, max_workers=3)
+        >>> dfs["FR"].head()
+        >>> for country, df in pycof.execute_many_sql(queries, as_completed=True):
+        ...     print(country, len(df))
+
+    :Returns:
+        * :obj:`list` or :obj:`dict`: Outputs of the queries, in the order of the queries (a :obj:`dict` if queries are provided as a :obj:`dict`).
+        * :obj:`generator`: Tuples of the query key (index or name) and its output if :obj:`as_completed=True`.
+    """
+    if errors not in ["raise", "return", "ignore"]:
+        raise ValueError(f"errors should either be 'raise', 'return' or 'ignore', got '{errors}'")
+
+    keys = list(queries.keys()) if isinstance(queries, dict) else list(range(len(queries)))
+    sql_queries = list(queries.values()) if isinstance(queries, dict) else list(queries)
+
+    # Load the credentials once for all queries (IAM credentials are fetched only once)
+    config = _get_credentials(_get_config(credentials), profile_name=profile_name, connection=connection)
+    query_connection = "direct" if connection.lower() == "iam" else connection
+
+    # Queries always share the connections of the pool
+    kwargs.pop("pool", None)
+
+    def run(sql):
+        return remote_execute_sql(
+            sql, credentials=config, connection=query_connection, cache=cache, pool=True, verbose=False, **kwargs
+        )
+
+    def completed():
+        # The executor is created on the first iteration, a generator never iterated leaves no threads behind
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        progress = None
+        try:
+            futures = {executor.submit(run, sql): key for key, sql in zip(keys, sql_queries)}
+            progress = tqdm(total=len(futures)) if verbose else None
+            for future in concurrent.futures.as_completed(futures):
+                if progress is not None:
+                    progress.update(1)
+                error = future.exception()
+                if error is None:
+                    yield futures[future], future.result()
+                elif errors == "raise":
+                    raise error
+                else:
+                    yield futures[future], error if errors == "return" else None
+        finally:
+            # Queries not started yet are cancelled if the iteration stops
+            executor.shutdown(wait=False, cancel_futures=True)
+            if progress is not None:
+                progress.close()
+
+    if as_completed:
+        return completed()
+
+    outputs = dict(completed())
+    if isinstance(queries, dict):
+        return {key: outputs[key] for key in keys}
+    return [outputs[key] for key in keys]
+
+
+#######################################################################################################################
+
+
+# Close pooled connections
+def close_all():
+    """Close the SSH tunnels and database connections kept open by the connection pool.
+    Connections are pooled when running :py:meth:`pycof.sql.remote_execute_sql` with :obj:`pool=True`.
+    Idle connections are automatically closed after 5 minutes and when the Python process exits.
+
+    :Example:
+        >>> for country in ["FR", "US", "UK"]:
+        ...     df = pycof.remote_execute_sql(f"SELECT * FROM SCHEMA.TABLE WHERE country = '{country}'", pool=True)
+        >>> pycof.close_all()
+    """
+    _POOL.close_all()
 
 
 #######################################################################################################################
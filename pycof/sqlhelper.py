@@ -1,31 +1,51 @@
+import atexit
 import csv
 import datetime
 import getpass
-import hashlib
 import os
 import re
+import shutil
 import sqlite3
 import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
 import warnings
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from io import StringIO
 from types import SimpleNamespace
 
-import boto3
-import botocore
 import numpy as np
 import pandas as pd
-import paramiko
 import psycopg2
+import psycopg2.extras
 import sqlalchemy as sa
-import sshtunnel
-from fabric import Connection
 from tqdm import tqdm
 
+from .cache import (
+    _STORAGE_EXTENSIONS,
+    _memory_get,
+    _memory_put,
+    _record,
+    _seconds,
+    _settings,
+    _storage_options,
+    fingerprint,
+)
 from .data import read
 from .misc import (
+    _atomic_path,
+    _aws_client,
     _fake_tunnel,
+    _file_lock,
     _get_config,
     _pycof_folders,
     file_age,
+    setup_logging,
     verbose_display,
     write,
 )
@@ -34,10 +54,26 @@ from .misc import (
 # Cache data from SQL
 
 
-def _cache(sql, tunnel, query_type="SELECT", cache_time="24h", cache_file_name=None, cache_folder=None, verbose=False):
+def _cache(
+    sql,
+    tunnel,
+    query_type="SELECT",
+    cache_time="24h",
+    cache_file_name=None,
+    cache_folder=None,
+    verbose=False,
+    backend="pandas",
+    uri=None,
+    cache_key=None,
+    params=None,
+    incremental_column=None,
+    stale_while_revalidate=None,
+    tunnel_factory=None,
+):
     # Parse cache_time value
     if type(cache_time) in [float, int]:
         c_time = cache_time
+        age_fmt = "seconds"
     else:
         # Force the input to be a string
         str_c_time = str(cache_time).lower().replace(" ", "")
@@ -47,53 +83,119 @@ def _cache(sql, tunnel, query_type="SELECT", cache_time="24h", cache_file_name=N
         age_fmt = "".join(re.findall("[a-z]", str_c_time))
 
     # Hash the file's name to save the query and the data
-    file_name = (
-        cache_file_name if cache_file_name else hashlib.sha224(bytes(sql, "utf-8")).hexdigest().replace("-", "m")
-    )
-    file_name += "" if ".parquet" in file_name else ".parquet"
+    if cache_file_name:
+        file_name = cache_file_name
+    elif cache_key is not None:
+        # Custom keys are computed from the SQL query only, combine them with the parameters
+        file_name = cache_key(sql) if params is None else fingerprint(cache_key(sql), params)
+    else:
+        file_name = fingerprint(sql, params)
+    if not file_name.endswith(tuple(_STORAGE_EXTENSIONS.values())):
+        file_name += _STORAGE_EXTENSIONS[_settings["storage"]]
 
     # Set the query and data paths
     query_path = _pycof_folders("queries")
     data_path = cache_folder if cache_folder else _pycof_folders("data")
 
-    # Chec if the cached data already exists
-    if (query_type.upper() == "SELECT") & (file_name in os.listdir(data_path)):
-        # If file exists, checks its age
-        age = file_age(os.path.join(data_path, file_name), format=age_fmt)
-        size = os.path.getsize(os.path.join(data_path, file_name))
-        if (query_type.upper() == "SELECT") & (age < c_time) & (size > 4):
-            # If file is younger than c_time, we read the cached data
-            verbose_display("Reading cached data", verbose)
-            sql_out = read(os.path.join(data_path, file_name))
-        else:
-            # Else we execute the SQL query and save the ouput + the query
-            verbose_display("Execute SQL query and cache the data - updating cache", verbose)
-            conn = tunnel.connector()
-            warnings.filterwarnings(
-                "ignore", category=UserWarning, message=".*pandas only supports SQLAlchemy connectable.*"
-            )
-            sql_out = pd.read_sql(sql, conn)
-            conn.close()
-            write(sql, query_path + file_name, perm="w", verbose=verbose)
-            write(sql_out, os.path.join(data_path, file_name), index=False)
-    else:
-        # If the file does not even exist, we execute SQL, save the query and its output
-        verbose_display("Execute SQL query and cache the data", verbose)
-        conn = tunnel.connector()
+    data_file = os.path.join(data_path, file_name)
+
+    def execute_and_cache(tunnel=tunnel):
+        # Execute the SQL query and save the ouput + the query
         warnings.filterwarnings(
             "ignore", category=UserWarning, message=".*pandas only supports SQLAlchemy connectable.*"
         )
-        sql_out = pd.read_sql(sql, conn)
-        conn.close()
-        write(sql, os.path.join(query_path, file_name), perm="w", verbose=verbose)
-        write(sql_out, os.path.join(data_path, file_name), index=False)
+        with _checkout(tunnel) as conn:
+            if incremental_column is None:
+                sql_out = _read_sql(sql, conn, backend=backend, uri=uri, params=params)
+            else:
+                sql_out = _cache_append(
+                    sql, conn, data_file, incremental_column, backend=backend, uri=uri, params=params
+                )
+        # Write to temporary files renamed once complete, readers never see partially written files
+        with _atomic_path(os.path.join(query_path, file_name)) as tmp_path:
+            write(sql, tmp_path, perm="w", verbose=verbose)
+        if incremental_column is None:
+            if os.path.isdir(data_file):
+                # Entry previously refreshed incrementally
+                shutil.rmtree(data_file)
+            _cache_write(sql_out, data_file)
+        _record(data_file, hit=False, query_path=os.path.join(query_path, file_name), query=sql)
+        return sql_out
+
+    def is_fresh():
+        # Cached data exist and are younger than c_time
+        return (
+            os.path.exists(data_file)
+            and (file_age(data_file, format=age_fmt) < c_time)
+            and (len(_cache_parts(data_file)) > 0 if os.path.isdir(data_file) else os.path.getsize(data_file) > 4)
+        )
+
+    def is_stale_usable():
+        # Cached data expired for less than stale_while_revalidate
+        return (
+            (stale_while_revalidate is not None)
+            and os.path.exists(data_file)
+            and (file_age(data_file) < _seconds(cache_time) + _seconds(stale_while_revalidate))
+            and (len(_cache_parts(data_file)) > 0 if os.path.isdir(data_file) else os.path.getsize(data_file) > 4)
+        )
+
+    def refresh():
+        # Refresh in the background, unless another thread or process is already refreshing the data
+        with _file_lock(os.path.join(data_path, f".{file_name}.lock"), blocking=False) as locked:
+            if locked and not is_fresh():
+                if tunnel_factory is None:
+                    execute_and_cache()
+                else:
+                    with tunnel_factory() as refresh_tunnel:
+                        execute_and_cache(refresh_tunnel)
+
+    # Outputs kept in memory by previous calls are returned without reading the disk
+    in_memory = _memory_get(data_file, backend, ttl=_seconds(cache_time)) if query_type.upper() == "SELECT" else None
+    if in_memory is not None:
+        verbose_display("Reading cached data from memory", verbose)
+        sql_out, created = in_memory
+    elif (query_type.upper() == "SELECT") & (not is_fresh()) & is_stale_usable():
+        # Return the expired data right away and refresh them in the background
+        verbose_display("Reading expired cached data - refreshing cache in the background", verbose)
+        sql_out = _cache_read(data_file, backend=backend)
+        created = os.path.getmtime(data_file)
+        _record(data_file, hit=True)
+        _refresh_in_background(data_file, refresh)
+    else:
+        if (query_type.upper() == "SELECT") & is_fresh():
+            # If file is younger than c_time, we read the cached data
+            verbose_display("Reading cached data", verbose)
+            sql_out = _cache_read(data_file, backend=backend)
+            _record(data_file, hit=True)
+        else:
+            # Only one caller (process or thread) runs the query, the others wait and read its output
+            with _file_lock(os.path.join(data_path, f".{file_name}.lock")):
+                if (query_type.upper() == "SELECT") & is_fresh():
+                    verbose_display("Reading cached data", verbose)
+                    sql_out = _cache_read(data_file, backend=backend)
+                    _record(data_file, hit=True)
+                elif os.path.exists(data_file):
+                    # Else we execute the SQL query and save the ouput + the query
+                    verbose_display("Execute SQL query and cache the data - updating cache", verbose)
+                    sql_out = execute_and_cache()
+                else:
+                    # If the file does not even exist, we execute SQL, save the query and its output
+                    verbose_display("Execute SQL query and cache the data", verbose)
+                    sql_out = execute_and_cache()
+        created = os.path.getmtime(data_file)
+        if query_type.upper() == "SELECT":
+            _memory_put(data_file, sql_out, created, backend=backend)
+
+    if not isinstance(sql_out, pd.DataFrame):
+        # Metadata can only be attached to data frames, not to Arrow tables
+        return sql_out
 
     def age(fmt="seconds"):
         return file_age(file_path=os.path.join(data_path, file_name), format=fmt)
 
     sql_out.meta = SimpleNamespace()
     sql_out.meta.cache = SimpleNamespace()
-    sql_out.meta.cache.creation_date = datetime.datetime.now() - datetime.timedelta(seconds=age())
+    sql_out.meta.cache.creation_date = datetime.datetime.fromtimestamp(created)
     sql_out.meta.cache.cache_path = os.path.join(data_path, file_name)
     sql_out.meta.cache.query_path = os.path.join(query_path, file_name)
     sql_out.meta.cache._age_format = age_fmt
@@ -104,6 +206,378 @@ def _cache(sql, tunnel, query_type="SELECT", cache_time="24h", cache_file_name=N
     return sql_out
 
 
+_REFRESHING = set()
+_REFRESHING_LOCK = threading.Lock()
+
+
+def _refresh_in_background(data_file, refresh):
+    """Run :obj:`refresh` in a daemon thread, at most one per cache entry. Failures are logged."""
+    with _REFRESHING_LOCK:
+        if data_file in _REFRESHING:
+            return
+        _REFRESHING.add(data_file)
+
+    def run():
+        try:
+            refresh()
+        except Exception as err:
+            setup_logging(__name__).error(f"Background refresh of the cached data {data_file} failed: {err}")
+        finally:
+            with _REFRESHING_LOCK:
+                _REFRESHING.discard(data_file)
+
+    threading.Thread(target=run, name="pycof-cache-refresh", daemon=True).start()
+
+
+def _cache_read(path, backend="pandas", columns=None):
+    """Read cached data, as returned by :py:meth:`_read_sql` for the backend.
+    The storage format is given by the extension of the file (see :py:meth:`pycof.cache.configure`).
+    Entries refreshed incrementally are folders of part files, which are merged.
+    """
+    if os.path.isdir(path):
+        for attempt in range(3):
+            try:
+                return _cache_merge([_cache_read(part, backend, columns) for part in _cache_parts(path)], backend)
+            except FileNotFoundError:
+                # Parts deleted by a compaction while being listed, list them again
+                if attempt == 2:
+                    raise
+    ext = os.path.splitext(path)[1]
+    if (ext == ".parquet") & (backend == "pandas") & (columns is None):
+        return read(path)
+    import pyarrow as pa
+
+    if ext == ".parquet":
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path, columns=columns)
+    elif ext == ".feather":
+        import pyarrow.feather as feather
+
+        table = feather.read_table(path, columns=columns)
+    else:
+        # Arrow IPC files are memory-mapped without copy: pages are only read when accessed and are shared between
+        # processes through the page cache
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        table = table if columns is None else table.select(columns)
+
+    if backend == "pyarrow":
+        return table
+    elif (backend == "arrow") or ((ext == ".arrow") & _settings["zero_copy"]):
+        # Arrow-backed columns wrap the buffers of the table, memory-mapped ones are not copied
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+    # Columns are kept in separate blocks, so that numeric columns without nulls can reuse the Arrow buffers
+    return table.to_pandas(split_blocks=ext == ".arrow")
+
+
+def _cache_merge(outputs, backend="pandas"):
+    if backend == "pyarrow":
+        import pyarrow as pa
+
+        return _concat_arrow(outputs)
+    return pd.concat(outputs, ignore_index=True)
+
+
+def _concat_arrow(tables):
+    """Concatenate Arrow tables whose types were inferred separately.
+    Columns only holding NULL in a table are typed from the other tables, and numeric types are widened to a common
+    type (e.g. int64 and double, or Decimal values of different precisions returned by NUMERIC and DECIMAL columns).
+    """
+    import pyarrow as pa
+
+    return pa.concat_tables(tables, promote_options="permissive")
+
+
+def _cache_write(sql_out, path):
+    """Write cached data atomically in the storage format given by the extension of the file, with the options set in
+    :py:meth:`pycof.cache.configure`. Arrow tables are written directly without conversion to pandas.
+    """
+    options = _storage_options()
+    ext = os.path.splitext(path)[1]
+    with _atomic_path(path) as tmp_path:
+        if (ext == ".parquet") & isinstance(sql_out, pd.DataFrame):
+            write(sql_out, tmp_path, index=False, **options)
+        elif ext == ".parquet":
+            import pyarrow.parquet as pq
+
+            pq.write_table(sql_out, tmp_path, **options)
+        elif ext == ".feather":
+            import pyarrow.feather as feather
+
+            options = {k.replace("row_group_size", "chunksize"): v for k, v in options.items() if k != "use_dictionary"}
+            feather.write_feather(sql_out, tmp_path, **options)
+        else:
+            import pyarrow as pa
+
+            table = (
+                pa.Table.from_pandas(sql_out, preserve_index=False) if isinstance(sql_out, pd.DataFrame) else sql_out
+            )
+            # Uncompressed by default so that the file can be memory-mapped without decoding
+            ipc_options = pa.ipc.IpcWriteOptions(
+                compression=(
+                    None
+                    if options.get("compression") is None
+                    else pa.Codec(options["compression"], options.get("compression_level"))
+                )
+            )
+            with pa.OSFile(tmp_path, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema, options=ipc_options) as writer:
+                    writer.write_table(table, max_chunksize=options.get("row_group_size"))
+
+
+_MAX_PARTS = 16
+
+
+def _cache_parts(path):
+    """Part files of an incremental cache entry, in order.
+    Parts are named part-<first>-<last>.<ext> after the refreshes they hold. Parts already merged by a compaction
+    but not deleted yet are covered by the merged part and skipped.
+    """
+    ranges = []
+    for name in os.listdir(path):
+        match = re.fullmatch(r"part-(\d+)-(\d+)\.(parquet|feather|arrow)", name)
+        if match:
+            ranges.append((int(match.group(1)), int(match.group(2)), os.path.join(path, name)))
+    return [
+        part
+        for first, last, part in sorted(ranges)
+        if not any((a <= first) & (last <= b) & ((a, b) != (first, last)) for a, b, _ in ranges)
+    ]
+
+
+def _sql_literal(value):
+    """SQL literal of the last value of an incremental column (number, date or string)."""
+    if isinstance(value, (bool, np.bool_)):
+        return str(int(value))
+    elif isinstance(value, (int, float, np.integer, np.floating)):
+        return repr(value.item() if isinstance(value, np.generic) else value)
+    elif isinstance(value, (datetime.date, np.datetime64)):
+        value = pd.Timestamp(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _cache_append(sql, connector, path, column, backend="pandas", uri=None, params=None):
+    """Refresh an incremental cache entry. Only rows with :obj:`column` greater than its last cached value are queried,
+    and written as a new part file of the :obj:`path` folder. Returns the merged cached data.
+    """
+    if os.path.isfile(path):
+        # Entry cached before without incremental refresh
+        os.remove(path)
+    os.makedirs(path, exist_ok=True)
+    parts = _cache_parts(path)
+    if parts:
+        last = pd.concat([_cache_read(part, columns=[column]) for part in parts])[column].max()
+        if pd.notna(last):
+            sql = f"SELECT * FROM ({sql.strip().rstrip(';')}) pycof_incremental WHERE {column} > {_sql_literal(last)}"
+    new_rows = _read_sql(sql, connector, backend=backend, uri=uri, params=params)
+
+    number = int(re.findall(r"\d+", os.path.basename(parts[-1]))[-1]) + 1 if parts else 0
+    ext = _STORAGE_EXTENSIONS[_settings["storage"]]
+    if (len(new_rows) > 0) or (not parts):
+        _cache_write(new_rows, os.path.join(path, f"part-{number}-{number}{ext}"))
+        parts = _cache_parts(path)
+    else:
+        # No new rows, the cached data are up to date
+        os.utime(path)
+    if len(parts) > _MAX_PARTS:
+        # Merge the parts in one file. Readers skip the parts covered by the merged one until they are deleted.
+        _cache_write(_cache_read(path), os.path.join(path, f"part-0-{number}{ext}"))
+        for part in parts:
+            os.remove(part)
+    return _cache_read(path, backend)
+
+
+# #######################################################################################################################
+# Stream data from SQL
+
+
+def _server_side_cursor(connector):
+    """Open a cursor which keeps the result set on the database side and fetches rows on demand."""
+    if isinstance(connector, psycopg2.extensions.connection):
+        # Named cursors are declared on the server by psycopg2 (DECLARE ... CURSOR)
+        return connector.cursor(name=f"pycof_{uuid.uuid4().hex}")
+    elif isinstance(connector, sqlite3.Connection):
+        # SQLite cursors already step through the results lazily
+        return connector.cursor()
+    else:
+        # MySQL raw connection from SQLAlchemy, use an unbuffered cursor
+        import pymysql
+
+        return connector.cursor(pymysql.cursors.SSCursor)
+
+
+def _fetch_batches(sql, connector, chunksize=10000, params=None):
+    """Yield the column names and the rows of an SQL query by batches of :obj:`chunksize` rows.
+    The first batch is always returned, even if empty, so that callers know the columns of the query.
+
+    The cursor is only closed once all rows have been read. If the iteration stops before, the connection must be
+    dropped with :py:meth:`_abandon`: closing the cursor, or resetting the connection, would make an unbuffered MySQL
+    cursor read all the remaining rows.
+    """
+    cursor = _server_side_cursor(connector)
+    if params is None:
+        cursor.execute(sql)
+    else:
+        cursor.execute(sql, params)
+    columns = None
+    while True:
+        rows = cursor.fetchmany(chunksize)
+        if columns is None:
+            # Named psycopg2 cursors only describe the results after the first fetch
+            columns = [col[0] for col in cursor.description]
+        elif len(rows) == 0:
+            break
+        yield columns, rows
+    cursor.close()
+
+
+def _stream_sql(sql, tunnel, chunksize=10000, params=None):
+    """Generator returning the output of an SQL query as :obj:`pandas.DataFrame` batches.
+    The tunnel and the connection remain open until the generator is exhausted or closed.
+    """
+    with tunnel as tun:
+        conn = tun.connector()
+        exhausted = False
+        try:
+            for columns, rows in _fetch_batches(sql, _raw_connector(conn), chunksize=chunksize, params=params):
+                yield pd.DataFrame.from_records(rows, columns=columns, coerce_float=False)
+            exhausted = True
+        finally:
+            if exhausted:
+                conn.close()
+            elif isinstance(conn, _PooledConnection):
+                # Pooled connection with unread results cannot be reused
+                conn.discard()
+            else:
+                _abandon(conn)
+
+
+# #######################################################################################################################
+# Bind parameters and prepared statements
+
+# Raw psycopg2 connection -> {query: name of the prepared statement}
+_PREPARED = weakref.WeakKeyDictionary()
+_MAX_PREPARED = 100
+
+_PLACEHOLDERS = re.compile(r"%\((\w+)\)s|%s|%%")
+
+
+def _numbered_placeholders(sql, params):
+    """Convert psycopg2 placeholders (%s or %(name)s) to the $1, $2... placeholders of PREPARE.
+    As with psycopg2, placeholders are also replaced in string literals and a literal % must be written %%.
+    Returns the converted query and the list of values in the order of the placeholders.
+    """
+    values, names = [], {}
+    positional = iter(params) if isinstance(params, (list, tuple)) else None
+
+    def replace(match):
+        token = match.group()
+        if token == "%%":
+            return "%"
+        elif token == "%s":
+            values.append(next(positional))
+            return f"${len(values)}"
+        name = match.group(1)
+        if name not in names:
+            values.append(params[name])
+            names[name] = len(values)
+        return f"${names[name]}"
+
+    return _PLACEHOLDERS.sub(replace, sql), values
+
+
+def _execute(cursor, sql, params=None, prepare=False):
+    """Execute an SQL query on a cursor, with bind parameters if provided.
+    With :obj:`prepare=True` (pooled psycopg2 connections), the query is prepared on the server the first time it is
+    executed on the connection and later calls only send EXECUTE with the new parameters.
+    """
+    if params is None:
+        return cursor.execute(sql)
+    elif not prepare:
+        return cursor.execute(sql, params)
+    numbered_sql, values = _numbered_placeholders(sql, params)
+    statements = _PREPARED.setdefault(cursor.connection, {})
+    if numbered_sql not in statements:
+        if len(statements) >= _MAX_PREPARED:
+            cursor.execute("DEALLOCATE ALL")
+            statements.clear()
+        name = f"pycof_{uuid.uuid4().hex}"
+        cursor.execute(f"PREPARE {name} AS {numbered_sql}")
+        statements[numbered_sql] = name
+    arguments = f" ({', '.join(['%s'] * len(values))})" if values else ""
+    return cursor.execute(f"EXECUTE {statements[numbered_sql]}{arguments}", values)
+
+
+def _prepares(connector):
+    """Whether queries with bind parameters are prepared on the connection (pooled psycopg2 connections)."""
+    return isinstance(connector, _PooledConnection) and isinstance(
+        _raw_connector(connector), psycopg2.extensions.connection
+    )
+
+
+# #######################################################################################################################
+# Read data from SQL
+
+
+def _connection_uri(config, engine="default"):
+    """Connection URI for columnar drivers (connectorx), built from the credentials of a direct connection."""
+    hostname = config.get("DB_HOST")
+    port = config.get("DB_PORT")
+    db_type = _engine_type(hostname, port, engine)
+    if db_type == "sqlite":
+        return f"sqlite://{os.path.abspath(hostname)}"
+    user = urllib.parse.quote_plus(str(config.get("DB_USER")))
+    password = urllib.parse.quote_plus(str(config.get("DB_PASSWORD")))
+    database = config.get("DB_DATABASE") or ""
+    return f"{db_type}://{user}:{password}@{hostname}:{port}/{database}"
+
+
+def _read_arrow(sql, connector, uri=None, chunksize=100000, params=None):
+    """Read the output of an SQL query as a :obj:`pyarrow.Table`.
+    Uses connectorx if installed and a connection URI is available. Otherwise rows are fetched by batches from a
+    server-side cursor and converted to Arrow one batch at a time.
+    """
+    import pyarrow as pa
+
+    if (uri is not None) & (params is None):
+        try:
+            import connectorx as cx
+        except ImportError:
+            cx = None
+        if cx is not None:
+            return cx.read_sql(uri, sql, return_type="arrow")
+
+    tables = []
+    for columns, rows in _fetch_batches(sql, _raw_connector(connector), chunksize=chunksize, params=params):
+        arrays = [pa.array(list(values)) for values in zip(*rows)] if rows else [pa.array([])] * len(columns)
+        tables += [pa.Table.from_arrays(arrays, names=columns)]
+    return _concat_arrow(tables)
+
+
+def _read_sql(sql, connector, backend="pandas", uri=None, params=None, **kwargs):
+    """Read the output of an SQL query.
+
+    :param backend: 'pandas' for a :obj:`pandas.DataFrame`, 'arrow' for a :obj:`pandas.DataFrame` with Arrow-backed
+        dtypes or 'pyarrow' for a :obj:`pyarrow.Table`, defaults to 'pandas'
+    :param uri: Connection URI for connectorx with the Arrow backends, defaults to None
+    :param params: Bind parameters of the query, passed to the driver, defaults to None
+    """
+    if (backend == "pandas") & (params is not None) & _prepares(connector):
+        cursor = _raw_connector(connector).cursor()
+        _execute(cursor, sql, params, prepare=True)
+        columns = [col[0] for col in cursor.description]
+        sql_out = pd.DataFrame.from_records(cursor.fetchall(), columns=columns, **kwargs)
+        cursor.close()
+        return sql_out
+    elif backend == "pandas":
+        return pd.read_sql(sql, _raw_connector(connector), params=params, **kwargs)
+    elif backend in ["arrow", "pyarrow"]:
+        table = _read_arrow(sql, connector, uri=uri, params=params)
+        return table if backend == "pyarrow" else table.to_pandas(types_mapper=pd.ArrowDtype)
+    else:
+        raise ValueError(f"Backend should either be 'pandas', 'arrow' or 'pyarrow', got '{backend}'")
+
+
 # #######################################################################################################################
 # Get DB credentials
 
@@ -137,22 +611,18 @@ def _get_credentials(config, profile_name=None, connection="direct"):
     # Get AWS credentials with access and secret key
     if (useIAM) & (secret_key in [None, "None", ""]):
         try:
-            session = boto3.Session(profile_name=profile_name)
+            rd_client = _aws_client("redshift", profile_name=profile_name)
         except Exception:
             raise ConnectionError(boto_error)
     elif useIAM:
         try:
-            session = boto3.Session(aws_access_key_id=access_key, aws_secret_access_key=secret_key, region_name=region)
+            rd_client = _aws_client("redshift", access_key=access_key, secret_key=secret_key, region=region)
         except Exception:
-            session = boto3.Session(
-                profile_name=profile_name,
-                aws_access_key_id=access_key,
-                aws_secret_access_key=secret_key,
-                region_name=region,
+            rd_client = _aws_client(
+                "redshift", profile_name=profile_name, access_key=access_key, secret_key=secret_key, region=region
             )
 
     if useIAM:
-        rd_client = session.client("redshift")
         cluster_creds = rd_client.get_cluster_credentials(
             DbUser=user, DbName=database, ClusterIdentifier=cluster_name, AutoCreate=False
         )
@@ -163,6 +633,25 @@ def _get_credentials(config, profile_name=None, connection="direct"):
     return config
 
 
+# #######################################################################################################################
+# Get database type
+
+
+def _engine_type(hostname, port=None, engine="default"):
+    """Type of database to connect to, from the host name, the port and the engine: 'redshift', 'sqlite' or 'mysql'."""
+    hostname = str(hostname)
+    if ("redshift" in hostname.lower().split(".")) or (engine.lower() == "redshift"):
+        return "redshift"
+    elif (
+        (hostname.lower().find("sqlite") > -1)
+        or (str(port).lower() in ["sqlite", "sqlite3"])
+        or (engine.lower() in ["sqlite", "sqlite3"])
+    ):
+        return "sqlite"
+    else:
+        return "mysql"
+
+
 # #######################################################################################################################
 # Get SSH tunnel
 
@@ -198,13 +687,13 @@ class SSHTunnel:
                 else:
                     raise ConnectionError(f"Failed to establish SSH connection: {str(e)}")
         else:
-            self.tunnel = _fake_tunnel
-            self.tunnel.connector = self._define_connector
+            self.tunnel = _fake_tunnel(self._define_connector)
 
         return self.tunnel
 
     def _setup_ssh_tunnel(self):
         """Set up SSH tunnel using either sshtunnel or direct paramiko implementation"""
+        import paramiko
 
         # Patch DSSKey if it's missing (Paramiko 3.0+ compatibility)
         if not hasattr(paramiko, "DSSKey"):
@@ -221,6 +710,8 @@ class SSHTunnel:
 
     def _setup_sshtunnel(self):
         """Original sshtunnel implementation"""
+        import sshtunnel
+
         ssh_port = 22 if self.config.get("SSH_PORT") is None else int(self.config.get("SSH_PORT"))
         remote_addr = "localhost" if self.config.get("DB_REMOTE_HOST") is None else self.config.get("DB_REMOTE_HOST")
         remote_port = 3306 if self.config.get("DB_REMOTE_PORT") is None else int(self.config.get("DB_REMOTE_PORT"))
@@ -279,8 +770,9 @@ class SSHTunnel:
             port = self.tunnel.local_bind_port
 
         # ### Initiate sql connection to the Database
+        db_type = _engine_type(hostname, port, self.engine)
         # Redshift
-        if ("redshift" in hostname.lower().split(".")) or (self.engine.lower() == "redshift"):
+        if db_type == "redshift":
             try:
                 connector = psycopg2.connect(
                     host=hostname, port=int(port), user=user, password=password, database=database
@@ -288,11 +780,7 @@ class SSHTunnel:
             except Exception:
                 raise ConnectionError("Failed to connect to the Redshfit cluster")
         # SQLite
-        elif (
-            (hostname.lower().find("sqlite") > -1)
-            or (str(port).lower() in ["sqlite", "sqlite3"])
-            or (self.engine.lower() in ["sqlite", "sqlite3"])
-        ):
+        elif db_type == "sqlite":
             try:
                 connector = sqlite3.connect(hostname)
             except Exception:
@@ -311,7 +799,11 @@ class SSHTunnel:
                     user=user, password=password, hostname=hostname, port=port
                 )
 
-                connector = sa.create_engine("mysql+pymysql://{}".format(params)).raw_connection()
+                # LOAD DATA LOCAL INFILE is only allowed by the client when explicitly requested
+                connect_args = {"local_infile": True} if self.config.get("DB_LOCAL_INFILE") else {}
+                connector = sa.create_engine(
+                    "mysql+pymysql://{}".format(params), connect_args=connect_args
+                ).raw_connection()
             except Exception:
                 raise ConnectionError("Failed to connect to the MySQL database")
 
@@ -319,94 +811,567 @@ class SSHTunnel:
 
 
 # #######################################################################################################################
-# Insert data to DB
+# Pool of SSH tunnels and connections
+
+
+def _raw_connector(connector):
+    """Database connection behind a connection checked out from the :obj:`ConnectionPool`."""
+    return connector._connector if isinstance(connector, _PooledConnection) else connector
+
+
+def _close_quietly(obj):
+    try:
+        obj.close()
+    except Exception:
+        pass
+
+
+@contextmanager
+def _checkout(tunnel):
+    """Connection of a tunnel, closed (or given back to the pool) once used.
+    If the query fails, the transaction is rolled back and the connection closed, pooled ones are dropped from the pool.
+    """
+    conn = tunnel.connector()
+    try:
+        yield conn
+    except BaseException:
+        if isinstance(conn, _PooledConnection):
+            conn.discard()
+        else:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            _close_quietly(conn)
+        raise
+    conn.close()
+
+
+def _abandon(connector):
+    """Close a connection without reading the results left on it.
+    SQLAlchemy raw connections (MySQL) are invalidated: closing them resets the connection, which makes an unbuffered
+    cursor read all its remaining rows, and keeps the DBAPI connection open in the engine pool.
+    """
+    try:
+        if hasattr(connector, "invalidate"):
+            connector.invalidate()
+        else:
+            connector.close()
+    except Exception:
+        pass
+
+
+class _PooledConnection:
+    """Proxy of a database connection checked out from a :obj:`ConnectionPool`.
+    Closing it gives the connection back to the pool instead of closing it.
+    """
+
+    def __init__(self, pool, key, connector):
+        self._pool = pool
+        self._key = key
+        self._connector = connector
+
+    def __getattr__(self, name):
+        return getattr(self._connector, name)
+
+    def close(self):
+        """Give the connection back to the pool."""
+        if self._connector is not None:
+            self._pool._release(self._key, self._connector)
+            self._connector = None
+
+    def discard(self):
+        """Close the connection without giving it back to the pool (e.g. if it is left with unread results)."""
+        if self._connector is not None:
+            self._pool._release(self._key, self._connector, reuse=False)
+            self._connector = None
+
+
+class _PooledTunnel:
+    """Context manager returned by :py:meth:`ConnectionPool.tunnel`, behaves as the tunnel from :obj:`SSHTunnel`."""
+
+    def __init__(self, pool, config, connection="direct", engine="default"):
+        self.pool = pool
+        self.config = config
+        self.connection = connection.lower()
+        self.engine = engine
+        self.key = pool._key(config, connection, engine)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.pool.evict()
+
+    def connector(self):
+        return self.pool._acquire(self.key, self.config, self.connection, self.engine)
+
+    def close(self):
+        pass
+
+
+class ConnectionPool:
+    """Process-wide pool of SSH tunnels and database connections.
+    Entries are keyed by host, port, user, database, engine and connection type. Idle connections are checked before
+    being reused and closed after :obj:`idle_timeout` seconds, SSH tunnels are closed once they have no connection left.
+    A background timer closes them even if the pool is not used anymore. SSH tunnels are opened and connections closed
+    outside of the pool lock, so that a slow SSH handshake only blocks the callers of the same key.
+
+    :Parameters:
+        * **idle_timeout** (:obj:`float`): Seconds after which idle connections and tunnels are closed (defaults 300).
+        * **max_idle** (:obj:`int`): Maximum number of idle connections kept per key (defaults 8).
+    """
+
+    def __init__(self, idle_timeout=300, max_idle=8):
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self._lock = threading.RLock()
+        # Key -> SimpleNamespace(tunnel, in_use, last_used)
+        self._tunnels = {}
+        # Key -> list of (connector, last_used)
+        self._idle = {}
+        # Key -> lock held while the tunnel of the key is opened
+        self._key_locks = {}
+        self._reaper = None
+
+    @staticmethod
+    def _key(config, connection="direct", engine="default"):
+        key = (
+            config.get("DB_HOST"),
+            str(config.get("DB_PORT")),
+            config.get("DB_USER"),
+            config.get("DB_DATABASE"),
+            engine.lower(),
+            connection.lower(),
+            bool(config.get("DB_LOCAL_INFILE")),
+        )
+        # SQLite connections can only be used in the thread which created them
+        if _engine_type(config.get("DB_HOST"), config.get("DB_PORT"), engine) == "sqlite":
+            key += (threading.get_ident(),)
+        return key
+
+    def tunnel(self, config, connection="direct", engine="default"):
+        """Tunnel from the pool, to be used as a context manager similarly to :obj:`SSHTunnel`."""
+        return _PooledTunnel(self, config, connection=connection, engine=engine)
+
+    @staticmethod
+    def _is_alive(connector):
+        try:
+            if getattr(connector, "closed", 0):
+                # Closed psycopg2 connection
+                return False
+            cursor = connector.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _get_tunnel(self, key, config, connection, engine):
+        """Return the tunnel entry of a key with one more connection in use, (re)opening the tunnel if needed.
+        Must be called with the lock of the key held, the tunnel is opened without holding the pool lock.
+        """
+        with self._lock:
+            entry = self._tunnels.get(key)
+            if entry is not None:
+                entry.in_use += 1
+        if (entry is not None) & (connection == "ssh"):
+            if not entry.tunnel.tunnel.is_active:
+                # SSH transport is down, drop the tunnel and its idle connections
+                with self._lock:
+                    entry.in_use -= 1
+                    dropped = self._pop_key(key)
+                self._close(*dropped)
+                entry = None
+        if entry is None:
+            tunnel = SSHTunnel(config, connection, engine)
+            tunnel.__enter__()
+            if connection == "ssh":
+                tunnel.tunnel.start()
+            entry = SimpleNamespace(tunnel=tunnel, in_use=1, last_used=time.time())
+            with self._lock:
+                self._tunnels[key] = entry
+        # Keep the latest credentials (e.g. temporary IAM passwords) for new connections
+        entry.tunnel.config = config
+        return entry
+
+    def _acquire(self, key, config, connection="direct", engine="default"):
+        while True:
+            self.evict()
+            with self._key_lock(key):
+                entry = self._get_tunnel(key, config, connection, engine)
+            with self._lock:
+                idle = self._idle.get(key, [])
+                connector = idle.pop()[0] if idle else None
+            if connector is None:
+                try:
+                    connector = entry.tunnel._define_connector()
+                except Exception:
+                    with self._lock:
+                        entry.in_use -= 1
+                    raise
+                return _PooledConnection(self, key, connector)
+            elif self._is_alive(connector):
+                return _PooledConnection(self, key, connector)
+            else:
+                _close_quietly(connector)
+                with self._lock:
+                    entry.in_use -= 1
+
+    def _release(self, key, connector, reuse=True):
+        if reuse:
+            try:
+                # Do not leave an open transaction on an idle connection
+                connector.rollback()
+            except Exception:
+                reuse = False
+        with self._lock:
+            entry = self._tunnels.get(key)
+            if entry is not None:
+                entry.in_use -= 1
+                entry.last_used = time.time()
+            idle = self._idle.setdefault(key, [])
+            if reuse & (entry is not None) & (len(idle) < self.max_idle):
+                idle.append((connector, time.time()))
+                connector = None
+        if connector is not None:
+            _abandon(connector)
+        self._schedule_reaper()
+
+    def _pop_key(self, key):
+        """Remove the idle connections and the tunnel of a key from the pool, to be closed with :py:meth:`_close`.
+        Must be called with the pool lock held.
+        """
+        return self._idle.pop(key, []), self._tunnels.pop(key, None)
+
+    @staticmethod
+    def _close(idle, entry):
+        for connector, _ in idle:
+            _close_quietly(connector)
+        if entry is not None:
+            entry.tunnel.__exit__(None, None, None)
+
+    def _schedule_reaper(self):
+        """Run :py:meth:`evict` in the background, so that idle connections are closed even if the pool is not used."""
+        with self._lock:
+            if self._reaper is None:
+                self._reaper = threading.Timer(self.idle_timeout, self._reap)
+                self._reaper.daemon = True
+                self._reaper.start()
+
+    def _reap(self):
+        with self._lock:
+            self._reaper = None
+        self.evict()
+        with self._lock:
+            remaining = bool(self._tunnels) | any(self._idle.values())
+        if remaining:
+            self._schedule_reaper()
+
+    def evict(self):
+        """Close the connections and tunnels idle for more than :obj:`idle_timeout` seconds."""
+        now = time.time()
+        expired, dropped = [], []
+        with self._lock:
+            for key in list(self._idle.keys()):
+                keep = []
+                for connector, last_used in self._idle[key]:
+                    if now - last_used > self.idle_timeout:
+                        expired.append((connector, last_used))
+                    else:
+                        keep.append((connector, last_used))
+                self._idle[key] = keep
+            for key, entry in list(self._tunnels.items()):
+                if (entry.in_use <= 0) & (not self._idle.get(key)) & (now - entry.last_used > self.idle_timeout):
+                    dropped.append(self._pop_key(key))
+        self._close(expired, None)
+        for idle, entry in dropped:
+            self._close(idle, entry)
+
+    def close_all(self):
+        """Close all idle connections and all tunnels of the pool."""
+        with self._lock:
+            dropped = [self._pop_key(key) for key in set(self._idle.keys()) | set(self._tunnels.keys())]
+            if self._reaper is not None:
+                self._reaper.cancel()
+                self._reaper = None
+        for idle, entry in dropped:
+            self._close(idle, entry)
+
+
+_POOL = ConnectionPool(idle_timeout=float(os.environ.get("PYCOF_POOL_TIMEOUT", 300)))
+atexit.register(_POOL.close_all)
+
 
 # #######################################################################################################################
 # SSH Tunnel Factory Function (for backward compatibility)
 
 
-def create_ssh_tunnel(config, connection="direct", engine="default"):
+def create_ssh_tunnel(config, connection="direct", engine="default", pool=False):
     """
-    Factory function to create SSH tunnel (currently just wraps SSHTunnel for compatibility).
+    Factory function to create SSH tunnel (wraps SSHTunnel for compatibility).
 
     Args:
         config: Configuration dictionary
         connection: Connection type ('direct' or 'ssh')
         engine: Database engine type
+        pool: Reuse the tunnel and connections from the process-wide connection pool
 
     Returns:
         SSH tunnel instance
     """
+    if pool:
+        return _POOL.tunnel(config, connection, engine)
     return SSHTunnel(config, connection, engine)
 
 
 # #######################################################################################################################
-# Insert data to SQL
+# Insert data to DB
 
 
-def _insert_data(data, table, connector, autofill_nan=False, verbose=False):
+def _insert_data(
+    data,
+    table,
+    connector,
+    autofill_nan=False,
+    verbose=False,
+    method="executemany",
+    batch_size=10000,
+    workers=1,
+    single_transaction=False,
+    multi_row=False,
+    connector_factory=None,
+):
+    if method not in ["executemany", "copy"]:
+        raise ValueError(f"Insert method should either be 'executemany' or 'copy', got '{method}'")
     # Check if user defined the table to publish
     if table == "":
         raise SyntaxError("Destination table not defined by user")
+    if (workers > 1) & single_transaction:
+        raise ValueError("A single transaction cannot be shared by several workers, use workers=1")
     # Create the column string and the number of columns used for push query
     columns_string = (", ").join(list(data.columns))
     col_num = len(list(data.columns)) - 1
 
     # calculate the size of the dataframe to be pushed
     num = len(data)
-    batches = int(num / 10000) + 1
+
+    if num == 0:
+        raise ValueError("len(data) == 0 -> No data to insert")
 
     # #######################################################################################################################
-    # Transform date columns to str before loading
-    warnings.filterwarnings("ignore")  # Removing filter warning when changing data type
-    dt_cols = []
-    for col in data.columns:
-        if type(data.sample(1).reset_index()[col][0]) in [datetime.date, pd._libs.tslibs.timestamps.Timestamp]:
-            try:
-                data.loc[:, col] = pd.to_datetime(data[col]).apply(str)
-                dt_cols += [col]
-            except ValueError:
-                pass
-        elif data[col].dtype in [np.dtype("<M8[ns]"), np.dtype("datetime64[ns]")]:
-            dt_cols += [col]
-            data.loc[:, col] = data[col].apply(str)
-    warnings.filterwarnings("default")  # Putting warning back
+    # Bulk load with COPY (Postgres) or LOAD DATA (MySQL)
+    raw = _raw_connector(connector)
+    is_sqlite = isinstance(raw, sqlite3.Connection)
+    if (method == "copy") & (not is_sqlite):
+        _copy_data(data=data, table=table, connector=connector, autofill_nan=autofill_nan, verbose=verbose)
+        return
 
     # #######################################################################################################################
-    # Fill Nan values if requested by user
-    if autofill_nan:
-        """
-        For each row of the dataset, we fill the NaN values
-        with a specific string that will be replaced by None
-        value (converted by NULL in MySQL). This aims at avoiding
-        the PyMySQL 1054 error.
-        """
-        data_load = []
-        for ls in [v for v in data.fillna("@@@@EMPTYDATA@@@@").values.tolist()]:
-            data_load += [[None if vv == "@@@@EMPTYDATA@@@@" else vv for vv in ls]]
-    else:
-        data_load = data.values.tolist()
+    # Convert dates to str and fill NaN values if requested by user
+    data_load = _prepare_rows(data, autofill_nan=autofill_nan)
 
     # #######################################################################################################################
-    # Push 10k batches iterativeley and then push the remainder
-    if isinstance(connector, sqlite3.Connection):
-        insert_string = f'INSERT INTO {table} ({columns_string}) VALUES ({"?, " * col_num} ? )'
-    else:
-        insert_string = f'INSERT INTO {table} ({columns_string}) VALUES ({"%s, " * col_num} %s )'
+    # Build the INSERT statement
+    placeholders = f'({"?, " * col_num} ? )' if is_sqlite else f'({"%s, " * col_num} %s )'
+    insert_string = f"INSERT INTO {table} ({columns_string}) VALUES "
+    if is_sqlite:
+        # SQLite has no bulk load command, push all rows in a single transaction
+        single_transaction = single_transaction or (method == "copy")
+        # SQLite connections cannot be shared between threads and the database only allows one writer
+        workers = 1
+        if multi_row:
+            # Stay below the maximum number of parameters of a statement
+            batch_size = min(batch_size, max(1, raw.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER) // (col_num + 1)))
+
+    def push(cursor, rows):
+        if multi_row:
+            # One INSERT with multiple VALUES, for drivers not batching executemany (e.g. psycopg2)
+            cursor.execute(insert_string + ", ".join([placeholders] * len(rows)), rows.ravel().tolist())
+        else:
+            cursor.executemany(insert_string + placeholders, rows.tolist())
 
-    if num == 0:
-        raise ValueError("len(data) == 0 -> No data to insert")
-    elif num > 10000:
-        rg = tqdm(range(0, batches - 1)) if verbose else range(0, batches - 1)
-        cursor = connector.cursor()
-        for i in rg:
-            cursor.executemany(insert_string, data_load[i * 10000 : (i + 1) * 10000])
-            connector.commit()
-        # Push the remainder
-        cursor.executemany(insert_string, data_load[(batches - 1) * 10000 :])
-        connector.commit()
+    # #######################################################################################################################
+    # Push batches of batch_size rows, split across workers
+    batches = [(i, min(i + batch_size, num)) for i in range(0, num, batch_size)]
+    progress = tqdm(total=len(batches)) if verbose else None
+
+    def run(conn, worker_batches):
+        cursor = conn.cursor()
+        try:
+            for start, end in worker_batches:
+                push(cursor, data_load[start:end])
+                if not single_transaction:
+                    conn.commit()
+                if progress is not None:
+                    progress.update(1)
+        except Exception:
+            # Only the batch being pushed (or the whole transaction) is lost, committed batches are kept
+            conn.rollback()
+            raise
+        conn.commit()
+
+    try:
+        if workers <= 1:
+            run(connector, batches)
+        else:
+            if connector_factory is None:
+                raise ValueError("Inserting with several workers requires a connector_factory")
+
+            def worker(k):
+                # Each worker has its own connection, the first one uses the connection provided
+                conn = connector if k == 0 else connector_factory()
+                try:
+                    run(conn, batches[k::workers])
+                finally:
+                    if k > 0:
+                        conn.close()
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for future in [executor.submit(worker, k) for k in range(min(workers, len(batches)))]:
+                    future.result()
+    finally:
+        if progress is not None:
+            progress.close()
+
+
+def _date_columns(data):
+    """Date and datetime columns of the data frame converted to str, by column position.
+    Columns are detected from their dtype, object columns holding dates or datetimes are inferred. NaT become NaN.
+    """
+    columns = {}
+    for i, (col, dtype) in enumerate(data.dtypes.items()):
+        values = data.iloc[:, i]
+        if dtype == object:
+            if pd.api.types.infer_dtype(values, skipna=True) not in ["date", "datetime"]:
+                continue
+            try:
+                values = pd.to_datetime(values)
+            except (ValueError, TypeError):
+                continue
+        elif not pd.api.types.is_datetime64_any_dtype(dtype):
+            continue
+        columns[i] = values.astype(str).where(values.notna())
+    return columns
+
+
+def _prepare_rows(data, autofill_nan=False):
+    """Rows of the data frame to be inserted, as a 2D object array.
+    Dates are converted to str and NaN values are replaced by None if :obj:`autofill_nan`, to be converted into NULL
+    by the SQL drivers (avoids the PyMySQL 1054 error). The input data frame is not modified and the array is the
+    only copy of the data: conversions are done column by column.
+    """
+    dates = _date_columns(data)
+    rows = np.empty(data.shape, dtype=object)
+    for i in range(data.shape[1]):
+        values = dates[i] if i in dates else data.iloc[:, i]
+        rows[:, i] = values.to_numpy(dtype=object)
+        if autofill_nan:
+            rows[pd.isna(rows[:, i]), i] = None
+    return rows
+
+
+# Characters escaped in the text data sent to LOAD DATA (MySQL, fields enclosed by quotes) and COPY (Postgres text
+# format, tab-separated without quotes). A string holding the NULL marker \N is then loaded as text.
+_LOAD_DATA_ESCAPES = str.maketrans({"\\": "\\\\"})
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def _csv_frame(data, escapes=None, keep_nan=False):
+    """Prepare the data frame to be written as CSV for a bulk load.
+    Dates are converted as for :obj:`executemany` inserts, float columns holding only integers (e.g. integers with
+    NaN) are written without decimals so that they can be loaded into integer columns, booleans are written as 0/1
+    (NA as NULL) and special characters of strings can be escaped. With :obj:`keep_nan`, NaN values of float columns
+    are written as 'NaN' instead of NULL, None and NA values of other columns remain NULL.
+    """
+    columns = {data.columns[i]: values for i, values in _date_columns(data).items()}
+    for col in data.columns:
+        values = data[col]
+        if col in columns:
+            continue
+        elif pd.api.types.is_float_dtype(values):
+            not_null = values.dropna()
+            if keep_nan & (len(not_null) < len(values)):
+                columns[col] = values.astype(object).where(values.notna(), "NaN")
+            elif (len(not_null) > 0) and (np.mod(not_null, 1) == 0).all():
+                columns[col] = values.astype("Int64")
+        elif pd.api.types.is_bool_dtype(values):
+            # Nullable integers keep NA values, astype(int) fails on nullable booleans
+            columns[col] = values.astype("Int64")
+        elif (escapes is not None) & ((values.dtype == object) or pd.api.types.is_string_dtype(values)):
+            columns[col] = values.map(lambda v: v.translate(escapes) if isinstance(v, str) else v)
+    return data.assign(**columns) if columns else data
+
+
+def _copy_data(data, table, connector, autofill_nan=True, verbose=False, chunksize=100000):
+    """Bulk load a data frame with :obj:`COPY ... FROM STDIN` for Postgres or :obj:`LOAD DATA LOCAL INFILE` for MySQL.
+    None and NA values are written as :obj:`\\N` (NULL), NaN values of float columns as well if :obj:`autofill_nan`
+    and as 'NaN' otherwise like for :obj:`executemany` inserts.
+    """
+    columns_string = (", ").join(list(data.columns))
+    raw = _raw_connector(connector)
+    cursor = connector.cursor()
+
+    # Postgres / Redshift
+    if isinstance(raw, psycopg2.extensions.connection):
+        cursor.execute("SELECT version()")
+        if "redshift" in cursor.fetchone()[0].lower():
+            # Redshift only copies from S3, DynamoDB, EMR or SSH hosts, not from STDIN.
+            # We then send multi-row INSERT statements in a single transaction.
+            psycopg2.extras.execute_values(
+                cursor,
+                f"INSERT INTO {table} ({columns_string}) VALUES %s",
+                _prepare_rows(data, autofill_nan=autofill_nan).tolist(),
+                page_size=10000,
+            )
+        else:
+            # Text format: unlike CSV, a NULL marker in the data can be escaped
+            copy_string = f"COPY {table} ({columns_string}) FROM STDIN"
+            csv_data = _csv_frame(data, escapes=_COPY_ESCAPES, keep_nan=not autofill_nan)
+            chunks = range(0, len(data), chunksize)
+            for i in tqdm(chunks) if verbose else chunks:
+                # Stream the data by chunks to keep the buffer small
+                buffer = StringIO()
+                csv_data.iloc[i : i + chunksize].to_csv(
+                    buffer, sep="\t", index=False, header=False, na_rep="\\N", quoting=csv.QUOTE_NONE
+                )
+                buffer.seek(0)
+                cursor.copy_expert(copy_string, buffer)
+    # SQLite has no bulk load, use a single executemany (see _insert_data)
+    elif isinstance(raw, sqlite3.Connection):
+        raise TypeError("COPY is not available for SQLite")
+    # MySQL
     else:
-        # Push everything if less then 10k (SQL Server limit)
-        cursor = connector.cursor()
-        cursor.executemany(insert_string, data_load)
-        connector.commit()
+        import pymysql
+
+        # PyMySQL can only send an actual file with LOAD DATA LOCAL INFILE
+        tmp_file = tempfile.NamedTemporaryFile(mode="w", suffix=".csv", delete=False, newline="")
+        try:
+            _csv_frame(data, escapes=_LOAD_DATA_ESCAPES, keep_nan=not autofill_nan).to_csv(
+                tmp_file, index=False, header=False, na_rep="\\N", chunksize=chunksize
+            )
+            tmp_file.close()
+            load_string = (
+                f"LOAD DATA LOCAL INFILE %s INTO TABLE {table} CHARACTER SET utf8mb4 "
+                "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '\\\\' "
+                f"LINES TERMINATED BY '\\n' ({columns_string})"
+            )
+            verbose_display("Loading data with LOAD DATA LOCAL INFILE", verbose)
+            try:
+                cursor.execute(load_string, (tmp_file.name,))
+            except pymysql.err.OperationalError as err:
+                # 1148 and 3948: local files are disabled by the server (the client flag is set by remote_execute_sql)
+                if err.args[0] not in [1148, 3948]:
+                    raise
+                raise ConnectionError(
+                    f"LOAD DATA LOCAL INFILE was refused, enable local_infile on the MySQL server: {err}"
+                )
+        finally:
+            tmp_file.close()
+            os.remove(tmp_file.name)
+    connector.commit()
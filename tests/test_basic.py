@@ -6,3 +6,42 @@ def test_version_exists():
     assert _version is not None
     assert isinstance(_version, str)
     assert len(_version.split(".")) >= 3
+
+
+def _import_times(code):
+    """Modules imported by running `code` in a new interpreter, with their cumulative import time in microseconds."""
+    import subprocess
+    import sys
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line and "cumulative" not in line:
+            _, cumulative, module = line.split("|")
+            times[module.strip()] = int(cumulative)
+    return times
+
+
+def test_import_time():
+    """Test that importing pycof, and using its formatting functions, does not load the heavy dependencies."""
+    heavy = {"pandas", "boto3", "sqlalchemy", "paramiko", "psycopg2", "dateparser", "googleapiclient"}
+
+    times = _import_times("import pycof")
+    assert heavy.isdisjoint(times)
+    assert times["pycof"] < 100_000
+
+    times = _import_times("import pycof; pycof.group(1234567)")
+    assert heavy.isdisjoint(times)
+
+
+def test_lazy_names():
+    """Test that the public names are still available from the package and resolve to the module functions."""
+    import pycof
+    import pycof.sql
+
+    assert pycof.remote_execute_sql is pycof.sql.remote_execute_sql
+    assert pycof.get_config is pycof.misc._get_config
+    assert all(hasattr(pycof, name) for name in pycof.__all__)
+    assert set(pycof.__all__) <= set(dir(pycof))
@@ -0,0 +1,286 @@
+import pandas as pd
+import pytest
+
+import pycof
+
+
+@pytest.fixture
+def data(tmp_path, monkeypatch):
+    """Small data frame, PYCOF folders are created in a temporary directory."""
+    monkeypatch.setenv("PYCOF_PATH", str(tmp_path))
+    return pd.DataFrame({"id": range(100), "country": ["FR", "US"] * 50, "value": [i / 10 for i in range(100)]})
+
+
+def test_read_parquet_pushdown(data, tmp_path):
+    """Test that only the requested columns and rows are read from parquet files and datasets."""
+    path = str(tmp_path / "data.parquet")
+    data.to_parquet(path, row_group_size=10)
+    df = pycof.read(path, columns=["id", "value"], filters=[("id", ">=", 90)])
+    assert list(df.columns) == ["id", "value"]
+    assert df["id"].tolist() == list(range(90, 100))
+
+    folder = str(tmp_path / "dataset.parquet")
+    data.to_parquet(folder, partition_cols=["country"])
+    df = pycof.read(folder, columns=["id", "country"], filters=[("country", "=", "FR")])
+    assert len(df) == 50
+    assert set(df["country"]) == {"FR"}
+
+
+@pytest.fixture
+def local_s3(monkeypatch):
+    """Serve s3://<path> from the local file system, the bucket being the first folder of the path."""
+    from pyarrow import fs
+
+    def local(*args):
+        return fs.SubTreeFileSystem("/", fs.LocalFileSystem())
+
+    monkeypatch.setattr(pycof.data, "_s3_filesystem", local)
+    monkeypatch.setattr(pycof.misc, "_s3_filesystem", local)
+    return lambda path: "s3:/" + str(path)
+
+
+def test_read_chunksize(data, tmp_path, local_s3):
+    """Test batches of CSV and JSON lines files, read locally and streamed from S3."""
+    csv_path, json_path = tmp_path / "data.csv", tmp_path / "data.json"
+    data.to_csv(csv_path, index=False)
+    data.to_json(json_path, orient="records", lines=True)
+    for path in [str(csv_path), local_s3(csv_path)]:
+        assert [len(batch) for batch in pycof.read(path, chunksize=40)] == [40, 40, 20]
+    for path in [str(json_path), local_s3(json_path)]:
+        assert [len(batch) for batch in pycof.read(path, lines=True, chunksize=40)] == [40, 40, 20]
+    pd.testing.assert_frame_equal(pycof.read(local_s3(csv_path)), data)
+
+
+def test_read_s3_parquet(data, tmp_path, local_s3):
+    """Test that parquet files are scanned on S3 with column projection and filters."""
+    path = tmp_path / "data.parquet"
+    data.to_parquet(path, row_group_size=10)
+    df = pycof.read(local_s3(path), columns=["id"], filters=[("id", "<", 5)])
+    assert df["id"].tolist() == list(range(5))
+
+
+def test_download_prefix(tmp_path, monkeypatch):
+    """Test the concurrent download of an S3 prefix, with retries of failed downloads."""
+    import threading
+
+    from botocore.exceptions import ClientError
+
+    from pycof.data import _download_prefix
+
+    keys = [f"folder/part-{i}.parquet" for i in range(20)] + ["folder/_SUCCESS"]
+    failed, lock = set(), threading.Lock()
+
+    class Paginator:
+        def paginate(self, Bucket, Prefix):
+            yield {"Contents": [{"Key": key} for key in keys[:10]]}
+            yield {"Contents": [{"Key": key} for key in keys[10:]]}
+
+    class Client:
+        def get_paginator(self, name):
+            return Paginator()
+
+        def download_file(self, bucket, key, filename, Config=None):
+            with lock:
+                if key not in failed:
+                    failed.add(key)
+                    raise ClientError({"Error": {"Code": "SlowDown"}}, "GetObject")
+            with open(filename, "w") as f:
+                f.write(key)
+
+    monkeypatch.setattr(pycof.data.time, "sleep", lambda seconds: None)
+    ext = _download_prefix(Client(), "bucket", "folder/", str(tmp_path), extensions=[".parquet"], max_workers=4)
+    assert ext == "parquet"
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(key.split("/")[-1] for key in keys[:20])
+
+
+def test_aws_clients(monkeypatch):
+    """Test that boto3 sessions and clients are created once and shared between calls and threads."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from pycof.misc import _aws_client, _aws_session
+
+    monkeypatch.setattr(pycof.misc, "_AWS_SESSIONS", {})
+    monkeypatch.setattr(pycof.misc, "_AWS_CLIENTS", {})
+    keys = dict(access_key="key", secret_key="secret", region="eu-west-1")
+    with ThreadPoolExecutor(8) as pool:
+        clients = list(pool.map(lambda i: _aws_client("s3", **keys), range(32)))
+    assert all(client is clients[0] for client in clients)
+    assert _aws_client("redshift", **keys) is not clients[0]
+    assert _aws_client("s3", **dict(keys, region="us-east-1")) is not clients[0]
+    wide = _aws_client("s3", max_pool_connections=32, **keys)
+    assert (wide is not clients[0]) and (wide.meta.config.max_pool_connections == 32)
+    assert len(pycof.misc._AWS_SESSIONS) == 2
+    assert _aws_session(**keys).get_credentials().access_key == "key"
+
+
+def test_s3_filesystem(monkeypatch):
+    """Test that S3 filesystems are shared until credentials change and bucket regions resolved once per bucket."""
+    from pyarrow import fs
+
+    from pycof.misc import _aws_session, _s3_filesystem
+
+    monkeypatch.setattr(pycof.misc, "_S3_REGIONS", {})
+    monkeypatch.setattr(pycof.misc, "_S3_FILESYSTEMS", {})
+    resolved = []
+    monkeypatch.setattr(fs, "resolve_s3_region", lambda bucket: resolved.append(bucket) or "eu-west-1")
+    session = _aws_session(access_key="key", secret_key="secret")
+    assert _s3_filesystem(session, "bucket") is _s3_filesystem(session, "bucket")
+    assert _s3_filesystem(session, "other") is _s3_filesystem(session, "bucket")
+    assert resolved == ["bucket", "other"]
+    assert _s3_filesystem(_aws_session(access_key="key", secret_key="secret", region="us-east-1"), "bucket").region == (
+        "us-east-1"
+    )
+
+    # Temporary credentials refreshed by boto3 give a new filesystem
+    from botocore.credentials import Credentials
+
+    class Session:
+        region_name = "eu-west-1"
+        credentials = Credentials("key", "secret", "token")
+
+        def get_credentials(self):
+            return self.credentials
+
+    session = Session()
+    filesystem = _s3_filesystem(session, "bucket")
+    assert _s3_filesystem(session, "bucket") is filesystem
+    session.credentials = Credentials("key", "secret", "refreshed")
+    assert _s3_filesystem(session, "bucket") is not filesystem
+
+
+class _FakeS3:
+    """In-memory S3 client recording the multipart upload calls."""
+
+    def __init__(self, fail_part=None):
+        self.objects, self.parts, self.calls = {}, {}, []
+        self.fail_part = fail_part
+
+    def put_object(self, Bucket, Key, Body):
+        self.calls.append("put_object")
+        self.objects[Key] = bytes(Body)
+
+    def create_multipart_upload(self, Bucket, Key):
+        self.calls.append("create_multipart_upload")
+        return {"UploadId": "upload"}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if PartNumber == self.fail_part:
+            raise IOError("Connection reset")
+        self.parts[PartNumber] = bytes(Body)
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.calls.append("complete_multipart_upload")
+        numbers = [part["PartNumber"] for part in MultipartUpload["Parts"]]
+        self.objects[Key] = b"".join(self.parts[n] for n in numbers)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.calls.append("abort_multipart_upload")
+
+
+def test_write_s3_multipart(data, tmp_path, monkeypatch):
+    """Test that data frames are streamed to S3 as multipart uploads, or a single PUT when small."""
+    from concurrent.futures import wait
+    from io import BytesIO
+
+    from pycof.misc import _S3MultipartWriter
+
+    s3 = _FakeS3()
+    monkeypatch.setattr(pycof.misc, "_aws_client", lambda service, **kwargs: s3)
+    monkeypatch.setattr(pycof.misc, "_s3_credentials", lambda profile_name, credentials: {})
+    pycof.write(data, "s3://bucket/data.csv", index=False)
+    assert s3.calls == ["put_object"]
+    assert pd.read_csv(BytesIO(s3.objects["data.csv"])).equals(data)
+
+    big = pd.concat([data] * 2000, ignore_index=True)
+    monkeypatch.setattr(pycof.misc, "_MIN_PART_SIZE", 1024)
+    pycof.write(big, "s3://bucket/big.parquet", part_size=16 * 1024, max_workers=2)
+    assert s3.calls[-2:] == ["create_multipart_upload", "complete_multipart_upload"]
+    assert len(s3.parts) > 1
+    assert pd.read_parquet(BytesIO(s3.objects["big.parquet"])).equals(big)
+
+    s3 = _FakeS3(fail_part=2)
+    writer = _S3MultipartWriter(s3, "bucket", "failed.csv", part_size=1024)
+    with pytest.raises(IOError):
+        with writer:
+            writer.write(b"x" * 10_000)
+    assert s3.calls[-1] == "abort_multipart_upload"
+    assert "failed.csv" not in s3.objects
+
+    # Writing stops at the first part that failed
+    s3 = _FakeS3(fail_part=1)
+    writer = _S3MultipartWriter(s3, "bucket", "failed.csv", part_size=1024)
+    writer.write(b"x" * 1024)
+    wait(writer._futures)
+    with pytest.raises(IOError):
+        writer.write(b"x" * 1024)
+    assert s3.calls[-1] == "abort_multipart_upload"
+    assert writer.closed
+
+
+def test_write_partitioned(data, tmp_path, local_s3):
+    """Test hive-partitioned datasets written locally and to S3, then read back with partition filters."""
+    for path in [str(tmp_path / "local"), local_s3(tmp_path / "s3")]:
+        pycof.write(data, path, partition_cols=["country"], max_rows_per_file=20, perm="w")
+        folder = tmp_path / path.split("/")[-1]
+        assert sorted(p.name for p in folder.iterdir()) == ["country=FR", "country=US"]
+        assert len(list((folder / "country=FR").iterdir())) == 3
+        df = pycof.read(path, extension="parquet", filters=[("country", "=", "US")])
+        assert sorted(df["id"]) == list(range(1, 100, 2))
+
+    # Appending adds files, overwriting replaces the partitions written
+    path = str(tmp_path / "local")
+    pycof.write(data, path, partition_cols=["country"])
+    assert len(pycof.read(path, extension="parquet")) == 200
+    pycof.write(data[data["country"] == "FR"], path, partition_cols=["country"], perm="w")
+    assert len(pycof.read(path, extension="parquet")) == 150
+
+
+@pytest.mark.parametrize("ext", ["csv", "parquet", "feather", "arrow", "xlsx", "json", "ndjson"])
+def test_write_formats(data, tmp_path, ext):
+    """Test that each data frame format written by write is read back by read."""
+    if ext == "xlsx":
+        pytest.importorskip("openpyxl")
+    kwargs = {"index": False} if ext in ["csv", "xlsx"] else {}
+    if ext in ["feather", "arrow"]:
+        kwargs["compression"] = "zstd"
+    path = str(tmp_path / f"data.{ext}")
+    pycof.write(data, path, perm="w", **kwargs)
+    pd.testing.assert_frame_equal(pycof.read(path), data, check_index_type=False)
+
+    with pytest.raises(ValueError):
+        pycof.write(data, str(tmp_path / "data.unknown"))
+    with pytest.raises(ValueError, match="xlsx"):
+        pycof.write(data, str(tmp_path / "data.xls"))
+
+
+def test_read_s3_prefix(data, tmp_path, monkeypatch):
+    """Test that an S3 folder without extension is downloaded to the cache and read with the format of its files."""
+    source = tmp_path / "source"
+    source.mkdir()
+    for i in range(2):
+        data.iloc[i * 50 : (i + 1) * 50].to_parquet(source / f"part-{i}.parquet")
+
+    class Paginator:
+        def paginate(self, Bucket, Prefix):
+            yield {"Contents": [{"Key": f"folder/{p.name}"} for p in sorted(source.iterdir())]}
+
+    class Client:
+        def get_paginator(self, name):
+            return Paginator()
+
+        def download_file(self, bucket, key, filename, Config=None):
+            with open(filename, "wb") as f:
+                f.write((source / key.split("/")[-1]).read_bytes())
+
+    monkeypatch.setattr(pycof.data, "_s3_credentials", lambda profile_name, credentials: {})
+    pools = []
+    monkeypatch.setattr(
+        pycof.data, "_aws_client", lambda service, **kwargs: pools.append(kwargs["max_pool_connections"]) or Client()
+    )
+    for _ in range(2):
+        # Downloaded first, then read from the cache
+        df = pycof.read("s3://bucket/folder/", columns=["id"])
+        assert sorted(df["id"]) == list(range(100))
+    # One connection per range request of the objects downloaded in parallel
+    assert pools == [32, 32]
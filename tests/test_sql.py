@@ -0,0 +1,780 @@
+import os
+import re
+import sqlite3
+import time
+
+import pandas as pd
+import pytest
+
+import pycof
+
+
+@pytest.fixture
+def credentials(tmp_path, monkeypatch):
+    """SQLite database with a small table, PYCOF folders are created in a temporary directory."""
+    monkeypatch.setenv("PYCOF_PATH", str(tmp_path))
+    db_path = str(tmp_path / "pycof_test.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE test_table (id INTEGER, name TEXT, value REAL)")
+    conn.executemany("INSERT INTO test_table VALUES (?, ?, ?)", [(i, f"name_{i}", i / 10) for i in range(25)])
+    conn.commit()
+    conn.close()
+    return {"DB_HOST": db_path}
+
+
+def test_select(credentials):
+    """Test a standard SELECT query."""
+    df = pycof.remote_execute_sql("SELECT * FROM test_table", credentials=credentials, engine="sqlite")
+    assert isinstance(df, pd.DataFrame)
+    assert df.shape == (25, 3)
+
+
+def test_select_stream(credentials):
+    """Test that streamed SELECT queries return batches with all rows."""
+    batches = pycof.remote_execute_sql(
+        "SELECT * FROM test_table", credentials=credentials, engine="sqlite", chunksize=10
+    )
+    sizes = [len(batch) for batch in batches]
+    assert sizes == [10, 10, 5]
+
+
+def test_select_stream_empty(credentials):
+    """Test that an empty streamed query still returns the columns."""
+    batches = list(
+        pycof.remote_execute_sql(
+            "SELECT * FROM test_table WHERE id < 0", credentials=credentials, engine="sqlite", stream=True
+        )
+    )
+    assert len(batches) == 1
+    assert list(batches[0].columns) == ["id", "name", "value"]
+
+
+def test_select_stream_early_exit():
+    """Test that stopping a stream early drops the MySQL connection without reading the remaining rows."""
+    from pycof.sqlhelper import _stream_sql
+
+    calls = []
+
+    class Cursor:
+        description = [("id",)]
+
+        def execute(self, sql):
+            pass
+
+        def fetchmany(self, size):
+            return [(i,) for i in range(size)]
+
+        def close(self):
+            calls.append("cursor.close")
+
+    class Connection:
+        """SQLAlchemy raw connection to MySQL, closing it would read the unbuffered results."""
+
+        def cursor(self, cursor_class=None):
+            return Cursor()
+
+        def close(self):
+            calls.append("close")
+
+        def invalidate(self):
+            calls.append("invalidate")
+
+    class Tunnel:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def connector(self):
+            return Connection()
+
+    batches = _stream_sql("SELECT id FROM big_table", Tunnel(), chunksize=10)
+    assert len(next(batches)) == 10
+    batches.close()
+    assert calls == ["invalidate"]
+
+
+def test_select_pool(credentials):
+    """Test that pooled calls reuse the same database connection."""
+    from pycof.sqlhelper import _POOL
+
+    pycof.remote_execute_sql("SELECT * FROM test_table", credentials=credentials, engine="sqlite", pool=True)
+    idle = [conn for conns in _POOL._idle.values() for conn, _ in conns]
+    assert len(idle) == 1
+    df = pycof.remote_execute_sql("SELECT * FROM test_table", credentials=credentials, engine="sqlite", pool=True)
+    assert df.shape == (25, 3)
+    assert [conn for conns in _POOL._idle.values() for conn, _ in conns] == idle
+    pycof.close_all()
+    assert _POOL._idle == {}
+
+
+def test_tunnel_connectors(tmp_path):
+    """Test that direct tunnels opened at the same time keep their own connector."""
+    from pycof.sqlhelper import SSHTunnel
+
+    paths = [str(tmp_path / f"db_{i}.db") for i in range(2)]
+    with (
+        SSHTunnel({"DB_HOST": paths[0]}, engine="sqlite") as first,
+        SSHTunnel({"DB_HOST": paths[1]}, engine="sqlite") as second,
+    ):
+        for tunnel, path in [(first, paths[0]), (second, paths[1])]:
+            conn = tunnel.connector()
+            assert conn.execute("PRAGMA database_list").fetchone()[2] == path
+            conn.close()
+
+
+def test_pool_reaper(credentials):
+    """Test that idle connections and tunnels are closed in the background when the pool is not used anymore."""
+    from pycof.sqlhelper import ConnectionPool
+
+    pool = ConnectionPool(idle_timeout=0.05)
+    with pool.tunnel(credentials, engine="sqlite") as tunnel:
+        tunnel.connector().close()
+    assert pool._tunnels
+    time.sleep(0.5)
+    assert (pool._tunnels, pool._idle) == ({}, {})
+
+
+def test_pool_failed_query(credentials):
+    """Test that connections of failed pooled queries are released and dropped from the pool."""
+    from pycof.sqlhelper import _POOL
+
+    for _ in range(3):
+        with pytest.raises(Exception):
+            pycof.remote_execute_sql("SELECT * FROM missing_table", credentials=credentials, engine="sqlite", pool=True)
+    with pytest.raises(Exception):
+        pycof.remote_execute_sql(
+            "DELETE FROM test_table WHERE missing = 1",
+            table="test_table",
+            credentials=credentials,
+            engine="sqlite",
+            pool=True,
+        )
+    assert [entry.in_use for entry in _POOL._tunnels.values()] == [0]
+    assert not any(_POOL._idle.values())
+    outputs = pycof.execute_many_sql(
+        ["SELECT * FROM missing_table", "SELECT * FROM test_table"],
+        credentials=credentials,
+        engine="sqlite",
+        errors="ignore",
+    )
+    assert outputs[0] is None
+    assert all(entry.in_use == 0 for entry in _POOL._tunnels.values())
+    assert len([conn for conns in _POOL._idle.values() for conn in conns]) == 1
+    pycof.close_all()
+
+
+def test_pool_slow_tunnel(monkeypatch):
+    """Test that opening a slow tunnel does not block the connections of other hosts."""
+    import threading
+
+    from pycof import sqlhelper
+
+    opening = threading.Event()
+    release = threading.Event()
+
+    class Tunnel:
+        def __init__(self, config, connection, engine):
+            self.config = config
+
+        def __enter__(self):
+            if self.config["DB_HOST"] == "slow":
+                opening.set()
+                release.wait(5)
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def _define_connector(self):
+            return sqlite3.connect(":memory:", check_same_thread=False)
+
+    monkeypatch.setattr(sqlhelper, "SSHTunnel", Tunnel)
+    pool = sqlhelper.ConnectionPool()
+    slow = threading.Thread(target=lambda: pool.tunnel({"DB_HOST": "slow"}).connector().close())
+    slow.start()
+    assert opening.wait(5)
+    # The slow tunnel is still being opened, other hosts are not blocked
+    start = time.time()
+    pool.tunnel({"DB_HOST": "fast"}).connector().close()
+    assert time.time() - start < 2
+    release.set()
+    slow.join()
+    pool.close_all()
+
+
+def test_insert_copy(credentials):
+    """Test the bulk load INSERT method, which uses a single transaction on SQLite."""
+    data = pd.DataFrame({"id": [100, 101, None], "name": ["a", None, "c"], "value": [0.5, 1.5, 2.5]})
+    pycof.remote_execute_sql(data, table="test_table", credentials=credentials, engine="sqlite", insert_method="copy")
+    df = pycof.remote_execute_sql("SELECT * FROM test_table", credentials=credentials, engine="sqlite")
+    assert len(df) == 28
+    assert df["name"].isna().sum() == 1
+
+
+def test_csv_frame():
+    """Test the conversion of a data frame to bulk load CSV data."""
+    from pycof.sqlhelper import _LOAD_DATA_ESCAPES, _csv_frame
+
+    data = pd.DataFrame(
+        {
+            "id": [1.0, None, 3.0],
+            "flag": pd.array([True, None, False], dtype="boolean"),
+            "path": ["a\\b", None, "c"],
+            "value": [0.5, 1.0, None],
+        }
+    )
+    csv = _csv_frame(data, escapes=_LOAD_DATA_ESCAPES)
+    assert csv["id"].dtype == "Int64"
+    assert csv["flag"].tolist()[::2] == [1, 0]
+    assert csv["flag"].isna().iloc[1]
+    assert csv["path"].iloc[0] == "a\\\\b"
+    assert csv["value"].dtype == float
+    assert data["path"].iloc[0] == "a\\b"
+    csv = _csv_frame(data, keep_nan=True)
+    assert csv["id"].tolist()[1] == "NaN"
+    assert pd.isna(csv["path"].iloc[1])
+
+
+class _StubCursor:
+    """Cursor recording the data sent with LOAD DATA LOCAL INFILE (MySQL) or COPY (Postgres)."""
+
+    def __init__(self):
+        self.loaded = []
+
+    def execute(self, query, params=None):
+        if query.startswith("LOAD DATA"):
+            with open(params[0]) as f:
+                self.loaded.append((query, f.read()))
+
+    def fetchone(self):
+        return ("PostgreSQL 16.0",)
+
+    def copy_expert(self, query, buffer):
+        self.loaded.append((query, buffer.read()))
+
+
+class _StubConnector:
+    def __init__(self):
+        self.stub = _StubCursor()
+        self.commits = 0
+
+    def cursor(self):
+        return self.stub
+
+    def commit(self):
+        self.commits += 1
+
+
+def _unescape(value, escapes):
+    return re.sub(r"\\(.)", lambda m: escapes.get(m[1], m[1]), value)
+
+
+def _parse_load_data(content):
+    """Rows loaded by MySQL from LOAD DATA ... ENCLOSED BY '"' ESCAPED BY '\\' data."""
+    import csv
+    from io import StringIO
+
+    escapes = {"n": "\n", "t": "\t", "r": "\r"}
+    return [[None if v == "\\N" else _unescape(v, escapes) for v in row] for row in csv.reader(StringIO(content))]
+
+
+def _parse_copy(content):
+    """Rows loaded by Postgres from COPY data in text format."""
+    escapes = {"n": "\n", "t": "\t", "r": "\r"}
+    return [[None if v == "\\N" else _unescape(v, escapes) for v in line.split("\t")] for line in content.splitlines()]
+
+
+@pytest.mark.parametrize("engine", ["mysql", "postgres"])
+@pytest.mark.parametrize("autofill_nan", [True, False])
+def test_copy_data(monkeypatch, engine, autofill_nan):
+    """Test that the data sent by bulk loads is read back by the database as inserted, with stub cursors."""
+    import psycopg2.extensions
+
+    from pycof.sqlhelper import _copy_data
+
+    connector = _StubConnector()
+    if engine == "postgres":
+        monkeypatch.setattr(psycopg2.extensions, "connection", _StubConnector)
+    names = ["a", None, "\\N", "tab\there", 'quote"d, comma', "back\\slash\nline"]
+    data = pd.DataFrame(
+        {"id": range(6), "flag": [True, False] * 3, "name": names, "value": [0.5, None, 1.5, 2.5, 3.5, 4.5]}
+    )
+    _copy_data(data, table="test_table", connector=connector, autofill_nan=autofill_nan)
+    query, content = connector.stub.loaded[0]
+    if engine == "mysql":
+        assert query.startswith("LOAD DATA LOCAL INFILE %s INTO TABLE test_table")
+        assert query.endswith("(id, flag, name, value)")
+        rows = _parse_load_data(content)
+    else:
+        assert query == "COPY test_table (id, flag, name, value) FROM STDIN"
+        rows = _parse_copy(content)
+    assert [row[2] for row in rows] == names
+    assert rows[0] == ["0", "1", "a", "0.5"]
+    assert rows[1][3] == (None if autofill_nan else "NaN")
+    assert connector.commits == 1
+
+
+class _FakeConnection:
+    """Connection recording the rows inserted, committed and rolled back. Fails on the rows of id fail_on."""
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.pending = []
+        self.committed = []
+        self.rollbacks = 0
+        self.closed = False
+
+    def cursor(self):
+        return self
+
+    def executemany(self, query, rows):
+        if self.fail_on in [row[0] for row in rows]:
+            raise ValueError("Insert failed")
+        self.pending += [row[0] for row in rows]
+
+    def commit(self):
+        self.committed += self.pending
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+def test_insert_workers():
+    """Test that batches are split across workers, each committing on its own connection."""
+    from pycof.sqlhelper import _insert_data
+
+    data = pd.DataFrame({"id": range(100), "name": "worker", "value": 1.0})
+    main = _FakeConnection()
+    created = []
+
+    def factory():
+        created.append(_FakeConnection())
+        return created[-1]
+
+    _insert_data(data, "test_table", main, batch_size=10, workers=3, connector_factory=factory)
+    connections = [main] + created
+    assert len(created) == 2
+    # Worker k pushes the batches k, k + 3, k + 6, ...
+    for k, conn in enumerate(connections):
+        assert conn.committed == [i for i in range(100) if (i // 10) % 3 == k]
+    assert all(conn.closed for conn in created) and not main.closed
+
+    # A failing worker rolls back its batch, the others still commit theirs
+    main, created = _FakeConnection(fail_on=35), []
+    with pytest.raises(ValueError):
+        _insert_data(
+            data,
+            "test_table",
+            main,
+            batch_size=10,
+            workers=3,
+            connector_factory=factory,
+        )
+    assert main.rollbacks == 1
+    assert main.committed == [i for i in range(30) if (i // 10) % 3 == 0]
+    assert all(conn.rollbacks == 0 for conn in created)
+    assert sorted(sum([conn.committed for conn in created], [])) == [i for i in range(100) if (i // 10) % 3 > 0]
+
+
+def test_insert_dates(credentials):
+    """Test that dates and NaN are converted without modifying the input data frame."""
+    data = pd.DataFrame(
+        {
+            "id": [1, 2],
+            "name": [pd.Timestamp("2020-01-01 10:00:00"), pd.NaT],
+            "value": [0.5, None],
+        }
+    )
+    original = data.copy()
+    pycof.remote_execute_sql(data, table="test_table", credentials=credentials, engine="sqlite")
+    pd.testing.assert_frame_equal(data, original)
+    df = pycof.remote_execute_sql("SELECT * FROM test_table WHERE id < 3", credentials=credentials, engine="sqlite")
+    assert df["name"].iloc[-2] == "2020-01-01 10:00:00"
+    assert df["name"].isna().iloc[-1]
+
+
+def test_insert_multi_row(credentials):
+    """Test INSERT with multi-row statements, small batches and a single transaction."""
+    data = pd.DataFrame({"id": range(100, 150), "name": "multi", "value": 1.0})
+    pycof.remote_execute_sql(
+        data,
+        table="test_table",
+        credentials=credentials,
+        engine="sqlite",
+        batch_size=7,
+        multi_row=True,
+        single_transaction=True,
+    )
+    df = pycof.remote_execute_sql(
+        "SELECT * FROM test_table WHERE name = 'multi'", credentials=credentials, engine="sqlite"
+    )
+    assert sorted(df["id"].tolist()) == list(range(100, 150))
+
+
+@pytest.mark.parametrize("cache", [False, "1h"])
+def test_select_arrow(credentials, cache):
+    """Test the Arrow backends, with and without cache."""
+    import pyarrow as pa
+
+    sql = "SELECT * FROM test_table"
+    table = pycof.remote_execute_sql(sql, credentials=credentials, engine="sqlite", backend="pyarrow", cache=cache)
+    assert isinstance(table, pa.Table)
+    assert table.num_rows == 25
+    df = pycof.remote_execute_sql(sql, credentials=credentials, engine="sqlite", backend="arrow", cache=cache)
+    assert isinstance(df["value"].dtype, pd.ArrowDtype)
+
+
+def test_read_arrow_types(tmp_path):
+    """Test Arrow batches and cache parts whose inferred types differ (Decimal precisions, integers and floats)."""
+    from decimal import Decimal
+
+    import pyarrow as pa
+
+    from pycof.sqlhelper import _cache_merge, _read_arrow
+
+    sqlite3.register_converter("pycof_decimal", lambda v: Decimal(v.decode()))
+    conn = sqlite3.connect(str(tmp_path / "types.db"), detect_types=sqlite3.PARSE_COLNAMES)
+    conn.execute("CREATE TABLE numbers (amount TEXT, value)")
+    rows = [("1.23", 1), ("4.56", None), ("123.456", 2.5), ("7891.2", 3), (None, 4)]
+    conn.executemany("INSERT INTO numbers VALUES (?, ?)", rows)
+    table = _read_arrow('SELECT amount AS "amount [pycof_decimal]", value FROM numbers', conn, chunksize=2)
+    conn.close()
+    assert table.schema.field("amount").type == pa.decimal128(7, 3)
+    assert table.schema.field("value").type == pa.float64()
+    assert table.column("amount").to_pylist()[2:4] == [Decimal("123.456"), Decimal("7891.2")]
+
+    parts = [table.slice(0, 2), pa.table({"amount": [Decimal("12345.6789")], "value": [None]})]
+    merged = _cache_merge(parts, backend="pyarrow")
+    assert merged.schema.field("amount").type == pa.decimal128(9, 4)
+    assert merged.num_rows == 3
+
+
+def test_aio_execute_sql(credentials):
+    """Test concurrent asynchronous queries and streamed batches."""
+    import asyncio
+
+    async def main():
+        sql = "SELECT * FROM test_table WHERE id < {}"
+        dfs = await asyncio.gather(
+            *[pycof.aio.execute_sql(sql.format(i), credentials=credentials, engine="sqlite") for i in range(1, 6)]
+        )
+        batches = await pycof.aio.execute_sql(sql.format(25), credentials=credentials, engine="sqlite", chunksize=10)
+        sizes = [len(batch) async for batch in batches]
+        return [len(df) for df in dfs], sizes
+
+    assert asyncio.run(main()) == ([1, 2, 3, 4, 5], [10, 10, 5])
+
+
+def test_execute_many_sql(credentials):
+    """Test concurrent queries, returned in order, with errors returned instead of raised."""
+    queries = {"small": "SELECT * FROM test_table WHERE id < 5", "wrong": "SELECT * FROM missing_table"}
+    queries["all"] = "SELECT * FROM test_table"
+    outputs = pycof.execute_many_sql(queries, credentials=credentials, engine="sqlite", errors="return")
+    assert list(outputs.keys()) == ["small", "wrong", "all"]
+    assert len(outputs["small"]) == 5
+    assert isinstance(outputs["wrong"], Exception)
+    assert len(outputs["all"]) == 25
+    with pytest.raises(Exception):
+        pycof.execute_many_sql(list(queries.values()), credentials=credentials, engine="sqlite")
+
+
+def test_execute_many_sql_generator(credentials):
+    """Test that pool is accepted and that closing the generator early stops the executor."""
+    import threading
+
+    queries = [f"SELECT * FROM test_table WHERE id = {i}" for i in range(20)]
+    threads = threading.active_count()
+    outputs = pycof.execute_many_sql(queries, max_workers=2, credentials=credentials, engine="sqlite", pool=False)
+    assert [len(df) for df in outputs] == [1] * 20
+    generator = pycof.execute_many_sql(
+        queries, max_workers=2, credentials=credentials, engine="sqlite", as_completed=True
+    )
+    key, df = next(generator)
+    assert len(df) == 1
+    generator.close()
+    time.sleep(0.5)
+    assert threading.active_count() <= threads + 1
+
+
+def test_cache_single_flight(credentials):
+    """Test that concurrent callers of the same cached query run it only once."""
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    from pycof.sqlhelper import _cache
+
+    calls = []
+    lock = threading.Lock()
+
+    class Tunnel:
+        def connector(self):
+            with lock:
+                calls.append(1)
+            time.sleep(0.2)
+            return sqlite3.connect(credentials["DB_HOST"])
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        futures = [executor.submit(_cache, "SELECT * FROM test_table", Tunnel(), cache_time="1h") for _ in range(5)]
+        outputs = [future.result() for future in futures]
+    assert len(calls) == 1
+    assert all(len(df) == 25 for df in outputs)
+
+
+def test_cache_management(credentials, monkeypatch):
+    """Test cache statistics, LRU eviction and invalidation."""
+    monkeypatch.setitem(pycof.cache._settings, "memory_bytes", 0)
+    queries = [f"SELECT * FROM test_table WHERE id < {i}" for i in range(1, 4)]
+    for sql in queries:
+        pycof.remote_execute_sql(sql, credentials=credentials, engine="sqlite", cache="1h")
+    pycof.remote_execute_sql(queries[0], credentials=credentials, engine="sqlite", cache="1h")
+    stats = pycof.cache.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"]) == (3, 1, 3)
+
+    # The second query is the least recently used
+    monkeypatch.setitem(pycof.cache._settings, "max_entries", 2)
+    pycof.cache.evict()
+    assert pycof.cache.stats()["entries"] == 2
+    assert pycof.cache.invalidate(query=queries[1]) == 0
+    assert pycof.cache.invalidate(query=queries[0]) == 1
+    assert len(pycof.cache.list_entries()) == 1
+    pycof.cache.clear()
+    assert pycof.cache.stats()["entries"] == 0
+
+
+def test_cache_index_batching(credentials, monkeypatch):
+    """Test that cache hits are batched instead of rewriting the index on each read."""
+    monkeypatch.setitem(pycof.cache._settings, "memory_bytes", 0)
+    sql = "SELECT * FROM test_table WHERE id < 5"
+    pycof.remote_execute_sql(sql, credentials=credentials, engine="sqlite", cache="1h")
+    index_path = pycof.cache._index_path()
+    saved = os.path.getmtime(index_path)
+    for _ in range(3):
+        pycof.remote_execute_sql(sql, credentials=credentials, engine="sqlite", cache="1h")
+    assert os.path.getmtime(index_path) == saved
+    assert pycof.cache.stats()["hits"] == 3
+    assert pycof.cache.list_entries()["hits"].tolist() == [3]
+
+
+def test_cache_memory(credentials, monkeypatch):
+    """Test that repeated cached queries are returned from memory, as copies if requested."""
+    sql = "SELECT * FROM test_table WHERE id < 10"
+    df = pycof.remote_execute_sql(sql, credentials=credentials, engine="sqlite", cache="1h")
+    hits = pycof.cache.stats()["memory_hits"]
+    assert pycof.remote_execute_sql(sql, credentials=credentials, engine="sqlite", cache="1h") is df
+    assert pycof.cache.stats()["memory_hits"] == hits + 1
+
+    # Memory hits keep the entry recently used on disk
+    last_access = pycof.cache.list_entries()["last_access"][0]
+    time.sleep(0.01)
+    pycof.remote_execute_sql(sql, credentials=credentials, engine="sqlite", cache="1h")
+    assert pycof.cache.list_entries()["last_access"][0] > last_access
+
+    monkeypatch.setitem(pycof.cache._settings, "copy_on_return", True)
+    copy = pycof.remote_execute_sql(sql, credentials=credentials, engine="sqlite", cache="1h")
+    assert copy is not df
+    pd.testing.assert_frame_equal(copy, df)
+
+    # Invalidated entries are dropped from memory as well
+    pycof.cache.invalidate(query=sql)
+    assert pycof.remote_execute_sql(sql, credentials=credentials, engine="sqlite", cache="1h") is not df
+
+
+def test_cache_memory_size(credentials, monkeypatch):
+    """Test the estimated size of outputs kept in memory, which is not computed when the memory tier is off."""
+    import pyarrow as pa
+
+    from pycof.cache import _nbytes
+
+    data = pd.DataFrame({"id": range(10_000), "name": [f"name_{i}" for i in range(10_000)]})
+    deep = data.memory_usage(index=True, deep=True).sum()
+    assert 0.9 * deep < _nbytes(data) < 1.1 * deep
+    table = pa.Table.from_pandas(data)
+    assert _nbytes(table) == table.nbytes
+
+    def fail(sql_out):
+        raise AssertionError("Output sized while the memory cache is disabled")
+
+    monkeypatch.setattr(pycof.cache, "_nbytes", fail)
+    monkeypatch.setitem(pycof.cache._settings, "memory_bytes", 0)
+    df = pycof.remote_execute_sql("SELECT * FROM test_table", credentials=credentials, engine="sqlite", cache="1h")
+    assert len(df) == 25
+
+
+def test_cache_fingerprint(credentials):
+    """Test that queries differing by comments, whitespaces or keyword case share the same cache entry."""
+    queries = [
+        "SELECT * FROM test_table WHERE name = 'name_1'",
+        "select *\n  from test_table -- Comment\n where name = 'name_1';",
+        "/* Comment */ Select * FROM test_table WHERE name = 'name_1'",
+    ]
+    assert len({pycof.cache.fingerprint(sql) for sql in queries}) == 1
+    assert pycof.cache.fingerprint(queries[0]) != pycof.cache.fingerprint(queries[0].replace("name_1", "NAME_1"))
+    assert pycof.cache.normalize("SELECT count( * ) , id FROM t") == "SELECT COUNT(*), id FROM t"
+    assert pycof.cache.fingerprint(queries[0], params=[1]) != pycof.cache.fingerprint(queries[0])
+
+    paths = {
+        pycof.remote_execute_sql(sql, credentials=credentials, engine="sqlite", cache="1h").meta.cache.cache_path
+        for sql in queries
+    }
+    assert len(paths) == 1
+    df = pycof.remote_execute_sql(
+        "SELECT * FROM test_table", credentials=credentials, engine="sqlite", cache="1h", cache_key=lambda sql: "all"
+    )
+    assert df.meta.cache.cache_path.endswith("all.parquet")
+
+
+def test_select_params(credentials):
+    """Test bind parameters, which are part of the cache key."""
+    sql = "SELECT * FROM test_table WHERE id < ?"
+    assert len(pycof.remote_execute_sql(sql, credentials=credentials, engine="sqlite", params=[5])) == 5
+    small = pycof.remote_execute_sql(sql, credentials=credentials, engine="sqlite", params=[3], cache="1h")
+    large = pycof.remote_execute_sql(sql, credentials=credentials, engine="sqlite", params=[10], cache="1h")
+    assert (len(small), len(large)) == (3, 10)
+    batches = pycof.remote_execute_sql(
+        "SELECT * FROM test_table WHERE name = :name",
+        credentials=credentials,
+        engine="sqlite",
+        params={"name": "name_2"},
+        stream=True,
+    )
+    assert [len(batch) for batch in batches] == [1]
+
+
+def test_numbered_placeholders():
+    """Test the conversion of psycopg2 placeholders for PREPARE."""
+    from pycof.sqlhelper import _numbered_placeholders
+
+    sql = "SELECT x FROM t WHERE id = %(id)s AND y > %(low)s AND z < %(id)s AND w LIKE 'a%%'"
+    assert _numbered_placeholders(sql, {"id": 1, "low": 2}) == (
+        "SELECT x FROM t WHERE id = $1 AND y > $2 AND z < $1 AND w LIKE 'a%'",
+        [1, 2],
+    )
+    assert _numbered_placeholders("SELECT * FROM t WHERE a = %s AND b = %s", (1, "b"))[0].endswith("a = $1 AND b = $2")
+
+
+def test_cache_incremental(credentials):
+    """Test that expired incremental cache entries only query and append the new rows."""
+    import os
+    import time
+
+    sql = "SELECT * FROM test_table"
+    kwargs = dict(credentials=credentials, engine="sqlite", cache=0.5, incremental_column="id")
+    df = pycof.remote_execute_sql(sql, **kwargs)
+    assert len(df) == 25
+
+    conn = sqlite3.connect(credentials["DB_HOST"])
+    conn.executemany("INSERT INTO test_table VALUES (?, ?, ?)", [(i, f"name_{i}", i / 10) for i in range(25, 30)])
+    conn.commit()
+    conn.close()
+    time.sleep(0.6)
+
+    df = pycof.remote_execute_sql(sql, **kwargs)
+    assert df["id"].tolist() == list(range(30))
+    parts = sorted(os.listdir(df.meta.cache.cache_path))
+    assert parts == ["part-0-0.parquet", "part-1-1.parquet"]
+    assert len(pd.read_parquet(os.path.join(df.meta.cache.cache_path, parts[1]))) == 5
+
+
+def test_cache_stale_while_revalidate(credentials):
+    """Test that expired cached data are returned right away and refreshed in the background."""
+    import time
+
+    from pycof.sqlhelper import _REFRESHING
+
+    sql = "SELECT COUNT(*) AS n FROM test_table"
+    kwargs = dict(credentials=credentials, engine="sqlite", cache=0.5, stale_while_revalidate="1h")
+    assert pycof.remote_execute_sql(sql, **kwargs)["n"][0] == 25
+
+    conn = sqlite3.connect(credentials["DB_HOST"])
+    conn.execute("INSERT INTO test_table VALUES (25, 'name_25', 2.5)")
+    conn.commit()
+    conn.close()
+    time.sleep(0.6)
+
+    assert pycof.remote_execute_sql(sql, **kwargs)["n"][0] == 25
+    for _ in range(50):
+        if not _REFRESHING:
+            break
+        time.sleep(0.1)
+    assert pycof.remote_execute_sql(sql, **kwargs)["n"][0] == 26
+
+
+def test_cache_refresh_concurrent(credentials, tmp_path, monkeypatch):
+    """Test that a background refresh connects to its own database while the caller queries another one."""
+    import threading
+
+    from pycof import sqlhelper
+
+    monkeypatch.setitem(pycof.cache._settings, "memory_bytes", 0)
+
+    other = {"DB_HOST": str(tmp_path / "other.db")}
+    conn = sqlite3.connect(other["DB_HOST"])
+    conn.execute("CREATE TABLE test_table (id INTEGER)")
+    conn.commit()
+    conn.close()
+
+    enter = sqlhelper.SSHTunnel.__enter__
+
+    def slow_enter(self):
+        tunnel = enter(self)
+        if threading.current_thread() is not threading.main_thread():
+            # Refresh in the background: the caller opens its own tunnel in the meantime
+            time.sleep(0.3)
+        return tunnel
+
+    sql = "SELECT COUNT(*) AS n FROM test_table"
+    kwargs = dict(engine="sqlite", cache=0.2, stale_while_revalidate="1h")
+    assert pycof.remote_execute_sql(sql, credentials=credentials, **kwargs)["n"][0] == 25
+    time.sleep(0.3)
+    monkeypatch.setattr(sqlhelper.SSHTunnel, "__enter__", slow_enter)
+    assert pycof.remote_execute_sql(sql, credentials=credentials, **kwargs)["n"][0] == 25
+    assert pycof.remote_execute_sql(sql, credentials=other, engine="sqlite")["n"][0] == 0
+    for _ in range(50):
+        if not sqlhelper._REFRESHING:
+            break
+        time.sleep(0.1)
+    kwargs["cache"] = "1h"
+    assert pycof.remote_execute_sql(sql, credentials=credentials, **kwargs)["n"][0] == 25
+
+
+@pytest.mark.parametrize("storage", ["parquet", "feather", "arrow-ipc"])
+def test_cache_storage(credentials, monkeypatch, storage):
+    """Test the storage formats of the cache, read back with each backend."""
+    monkeypatch.setitem(pycof.cache._settings, "memory_bytes", 0)
+    monkeypatch.setitem(pycof.cache._settings, "storage", storage)
+    monkeypatch.setitem(pycof.cache._settings, "compression", "zstd")
+    monkeypatch.setitem(pycof.cache._settings, "row_group_size", 10)
+    sql = "SELECT * FROM test_table"
+    df = pycof.remote_execute_sql(sql, credentials=credentials, engine="sqlite", cache="1h")
+    assert df.meta.cache.cache_path.endswith(pycof.cache._STORAGE_EXTENSIONS[storage])
+    for backend in ["pandas", "pyarrow", "pandas"]:
+        cached = pycof.remote_execute_sql(sql, credentials=credentials, engine="sqlite", cache="1h", backend=backend)
+        assert len(cached) == 25
+    pd.testing.assert_frame_equal(cached, df)
+
+
+def test_cache_zero_copy(tmp_path, monkeypatch):
+    """Test that cached Arrow IPC files are read without copying the data."""
+    import numpy as np
+    import pyarrow as pa
+
+    from pycof.sqlhelper import _cache_read, _cache_write
+
+    monkeypatch.setitem(pycof.cache._settings, "zero_copy", True)
+    path = str(tmp_path / "data.arrow")
+    data = pd.DataFrame({"id": np.arange(1_000_000), "value": np.random.random(1_000_000)})
+    _cache_write(data, path)
+
+    allocated = pa.total_allocated_bytes()
+    df = _cache_read(path)
+    assert pa.total_allocated_bytes() - allocated < 1024**2
+    assert isinstance(df["value"].dtype, pd.ArrowDtype)
+    assert df["id"].sum() == data["id"].sum()